@@ -0,0 +1,82 @@
+""" Wall time of a `qtapi` invocation, interpreter start included, with a
+config directory holding many contexts. Runs each case in a fresh process.
+
+    python benchmarks/bench_cli.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Invoke the cli group with a no-op subcommand, as a plugin command would be
+INVOKE = """
+import sys
+import click
+from qtrade_client.cli import cli
+cli.add_command(click.Command("noop", callback=lambda: None))
+cli.main(sys.argv[1:], obj={}, standalone_mode=False)
+"""
+
+CONTEXT = """ctx{0}:
+  endpoint: http://localhost:9898
+  key: "1:1111111111111111111111111111111111111111111111111111111111111111"
+  email: ops{0}@example.com
+"""
+
+
+def available():
+    try:
+        import click  # noqa: F401
+        import yaml  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def best_wall(args, repeat=5):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(args, env=env, stdout=subprocess.DEVNULL)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def run(n_files=50):
+    if not available():
+        # The cli needs click and PyYAML
+        return {}
+    cfg_dir = tempfile.mkdtemp()
+    try:
+        for i in range(n_files):
+            with open(os.path.join(cfg_dir, "ctx{}.yml".format(i)), "w") as f:
+                f.write(CONTEXT.format(i))
+        from qtrade_client.cli import load_contexts
+
+        def best(fn, number=20):
+            return min(timeit.repeat(fn, number=number, repeat=3)) / number
+        parse = best(lambda: load_contexts(cfg_dir, use_cache=False))
+        load_contexts(cfg_dir)
+        cached = best(lambda: load_contexts(cfg_dir))
+        return {
+            "load_contexts_{}_files_parse_sec".format(n_files): parse,
+            "load_contexts_{}_files_cached_sec".format(n_files): cached,
+            "python_startup_sec": best_wall([sys.executable, "-c", "pass"]),
+            "cli_import_sec": best_wall([sys.executable, "-c", "import qtrade_client.cli"]),
+            "cli_invoke_{}_contexts_sec".format(n_files): best_wall(
+                [sys.executable, "-c", INVOKE, "-d", cfg_dir, "-c", "ctx7", "noop"]),
+        }
+    finally:
+        shutil.rmtree(cfg_dir)
+
+
+if __name__ == "__main__":
+    for name, value in sorted(run().items()):
+        print("{:<32} {:>8.1f}ms".format(name, value * 1e3))
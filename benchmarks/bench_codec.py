@@ -0,0 +1,78 @@
+""" Per-request JSON CPU cost: the old path (stdlib dumps for logging, then
+requests encoding json= again, then res.json()) against encoding once with
+the client's codec.
+
+    python benchmarks/bench_codec.py
+"""
+import json
+import os
+import sys
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtrade_client.codec import JSONCodec, default_codec  # noqa: E402
+
+URL = "https://api.qtrade.io/v1/user/sell_limit"
+REQUEST = {"amount": "0.01000000", "price": "0.00651044", "market_id": 1}
+RESPONSE = json.dumps({"data": {"order": {
+    "id": 8987684, "market_amount": "0.01", "market_amount_remaining": "0.01",
+    "created_at": "2019-11-14T23:46:52.897345Z", "price": "1",
+    "order_type": "sell_limit", "market_id": 1, "open": True, "trades": []}}}).encode()
+
+
+def response():
+    res = requests.models.Response()
+    res._content = RESPONSE
+    res.encoding = "utf-8"
+    return res
+
+
+def legacy():
+    json.dumps(REQUEST)
+    requests.Request("POST", URL, json=REQUEST).prepare()
+    response().json()
+
+
+def encode_once(codec):
+    def run():
+        body = codec.dumps(REQUEST)
+        requests.Request("POST", URL, data=body,
+                         headers={"Content-Type": "application/json"}).prepare()
+        codec.loads(response().content)
+    return run
+
+
+def legacy_json_only():
+    json.dumps(REQUEST)
+    # What requests does with json=
+    json.dumps(REQUEST, allow_nan=False).encode("utf-8")
+    response().json()
+
+
+def json_only(codec):
+    def run():
+        codec.dumps(REQUEST)
+        codec.loads(response().content)
+    return run
+
+
+def run(number=20000):
+    def best(fn):
+        return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+    codec = default_codec()
+    return {
+        "json_legacy_sec": best(legacy),
+        "json_stdlib_once_sec": best(encode_once(JSONCodec())),
+        "json_{}_once_sec".format(codec.name): best(encode_once(codec)),
+        "json_only_legacy_sec": best(legacy_json_only),
+        "json_only_{}_sec".format(codec.name): best(json_only(codec)),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in sorted(run().items()):
+        print("{:<28} {:>8.2f}us".format(name, value * 1e6))
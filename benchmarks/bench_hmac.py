@@ -0,0 +1,84 @@
+""" Signatures per second of QtradeAuth against the original string-building
+implementation of hmac_generate.
+
+    python benchmarks/bench_hmac.py
+"""
+import base64
+import os
+import sys
+import time
+import timeit
+from hashlib import sha256
+
+import requests
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtrade_client.api import QtradeAuth  # noqa: E402
+
+KEY = "1:1111111111111111111111111111111111111111111111111111111111111111"
+URL = "https://api.qtrade.io/v1/user/sell_limit"
+BODY = b'{"amount": "0.01000000", "price": "0.00651044", "market_id": 1}'
+
+
+def legacy_hmac_generate(key, url_path, method, body=None, _time=None):
+    now = time.time() if _time is None else _time
+    timestamp = str(int(now))
+    url_obj = urlparse(url_path)
+
+    request_details = method + "\n"
+    uri = url_obj.path
+    if url_obj.query:
+        uri += "?" + url_obj.query
+    request_details += uri + "\n"
+    request_details += timestamp + "\n"
+    if body is not None:
+        if isinstance(body, str):
+            request_details += body + "\n"
+        else:
+            request_details += body.decode('utf8') + "\n"
+    else:
+        request_details += "\n"
+    request_details += key
+    hsh = sha256(request_details.encode("utf8")).digest()
+    signature = base64.b64encode(hsh)
+    return timestamp, signature.decode('utf8')
+
+
+class LegacyQtradeAuth(requests.auth.AuthBase):
+
+    def __init__(self, key):
+        self.key_id, self.key = key.split(":")
+
+    def __call__(self, req):
+        timestamp, signature = legacy_hmac_generate(self.key, req.url, req.method, body=req.body)
+        req.headers.update({
+            "Authorization": "HMAC-SHA256 {}:{}".format(self.key_id, signature),
+            "HMAC-Timestamp": timestamp
+        })
+        return req
+
+
+def signatures_per_second(auth, number=50000):
+    req = requests.Request("POST", URL, data=BODY).prepare()
+    seconds = min(timeit.repeat(lambda: auth(req), number=number, repeat=3))
+    return number / seconds
+
+
+def run():
+    return {
+        "legacy_sigs_per_sec": signatures_per_second(LegacyQtradeAuth(KEY)),
+        "fast_sigs_per_sec": signatures_per_second(QtradeAuth(KEY)),
+    }
+
+
+if __name__ == "__main__":
+    results = run()
+    for name, value in sorted(results.items()):
+        print("{:<24} {:>12,.0f}".format(name, value))
+    print("speedup {:.2f}x".format(results["fast_sigs_per_sec"] / results["legacy_sigs_per_sec"]))
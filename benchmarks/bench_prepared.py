@@ -0,0 +1,69 @@
+""" Client side cost of sending one request through Session.request against
+the per-endpoint prepared request templates. Responses come from an adapter
+that never touches the network, so only the client's own work is timed.
+
+    python benchmarks/bench_prepared.py
+"""
+import os
+import sys
+import timeit
+
+import requests
+import requests.adapters
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtrade_client.api import QtradeAPI  # noqa: E402
+
+KEY = "1:1111111111111111111111111111111111111111111111111111111111111111"
+BODY = b'{"data": {"order": {"id": 1}}}'
+
+
+class CannedAdapter(requests.adapters.BaseAdapter):
+    """ Answers every request with BODY """
+
+    def send(self, request, **kwargs):
+        res = requests.Response()
+        res.status_code = 200
+        res._content = BODY
+        res.request = request
+        res.url = request.url
+        return res
+
+    def close(self):
+        pass
+
+
+def per_call(prepared, number=5000):
+    api = QtradeAPI("https://api.qtrade.io", key=KEY)
+    api.honor_ratelimit = False
+    api.rs.mount("https://", CannedAdapter())
+    api.prepared_requests = prepared
+
+    def order():
+        api.post("/v1/user/sell_limit", amount="0.01000000", price="0.00651044", market_id=1)
+
+    def cancel():
+        api.post("/v1/user/cancel_order", id=5)
+
+    def orders():
+        api.get("/v1/user/orders", open="true")
+    return {name: min(timeit.repeat(fn, number=number, repeat=3)) / number
+            for name, fn in (("order", order), ("cancel", cancel), ("orders", orders))}
+
+
+def run():
+    results = {}
+    for mode, prepared in (("session", False), ("prepared", True)):
+        for name, sec in per_call(prepared).items():
+            results["{}_{}_call_sec".format(name, mode)] = sec
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    for name, value in sorted(results.items()):
+        print("{:<28} {:>8.1f}us".format(name, value * 1e6))
+    for name in ("order", "cancel", "orders"):
+        print("{} speedup {:.2f}x".format(name, results["{}_session_call_sec".format(name)] /
+                                         results["{}_prepared_call_sec".format(name)]))
@@ -0,0 +1,155 @@
+""" Local stand-in for the qTrade REST API, used by the benchmarks. Serves
+generated /v1/common, /v1/tickers and /v1/user/* payloads with realistic
+X-Ratelimit-* headers. """
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+
+def make_common(n_markets=150):
+    currencies = [{
+        "can_withdraw": True,
+        "code": "C{}".format(i),
+        "config": {
+            "price": 1.5,
+            "withdraw_fee": "0.001",
+            "default_signer": 5,
+            "required_confirmations": 10,
+            "explorerAddressURL": "https://example.com/address/",
+            "explorerTransactionURL": "https://example.com/tx/",
+        },
+        "long_name": "Coin {}".format(i),
+        "metadata": {"deposit_notices": []},
+        "precision": 8,
+        "status": "ok",
+        "type": "bitcoin_like",
+    } for i in range(n_markets)]
+    currencies.append(dict(currencies[0], code="BTC", long_name="Bitcoin"))
+    markets = [{
+        "base_currency": "BTC",
+        "can_cancel": True,
+        "can_trade": True,
+        "can_view": True,
+        "id": i + 1,
+        "maker_fee": "0",
+        "market_currency": "C{}".format(i),
+        "metadata": {"labels": []},
+        "taker_fee": "0.005",
+    } for i in range(n_markets)]
+    return {"currencies": currencies, "markets": markets}
+
+
+def make_tickers(n_markets=150):
+    return {"markets": [{
+        "ask": "0.00707017",
+        "bid": "0.00664751",
+        "day_avg_price": "0.0071579647440367",
+        "day_change": "0.0173330516998029",
+        "day_high": "0.00727268",
+        "day_low": "0.00713415",
+        "day_open": "0.00714877",
+        "day_volume_base": "0.00169664",
+        "day_volume_market": "0.23702827",
+        "id": i + 1,
+        "id_hr": "C{}_BTC".format(i),
+        "last": "0.00727268",
+    } for i in range(n_markets)]}
+
+
+def make_orders(n_orders=300, n_markets=150):
+    return {"orders": [{
+        "id": 9000000 + i,
+        "market_amount": "0.5672848",
+        "market_amount_remaining": "0.5672848",
+        "created_at": "2019-11-14T16:34:20.424601Z",
+        "price": "0.00651044",
+        "base_amount": "0.00371174",
+        "order_type": "buy_limit" if i % 2 else "sell_limit",
+        "market_id": i % n_markets + 1,
+        "open": True,
+        "trades": None,
+    } for i in range(n_orders)]}
+
+
+class MockExchange(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP server on a free local port. `latency` seconds are
+    added to every response to stand in for the network round trip. """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, n_markets=150, n_orders=300, ratelimit=100000):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.ratelimit = ratelimit
+        self.requests = 0
+        self._lock = threading.Lock()
+        order = {"order": make_orders(1)["orders"][0]}
+        self.routes = {
+            "/v1/common": json.dumps({"data": make_common(n_markets)}).encode(),
+            "/v1/tickers": json.dumps({"data": make_tickers(n_markets)}).encode(),
+            "/v1/user/orders": json.dumps({"data": make_orders(n_orders, n_markets)}).encode(),
+            "/v1/user/balances": json.dumps({"data": {"balances": [
+                {"currency": "C{}".format(i), "balance": "1.5"} for i in range(n_markets)]}}).encode(),
+            "/v1/user/cancel_order": b"",
+            "/v1/user/buy_limit": json.dumps({"data": order}).encode(),
+            "/v1/user/sell_limit": json.dumps({"data": order}).encode(),
+        }
+
+    @property
+    def endpoint(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer so headers and body leave in one segment; otherwise Nagle and
+    # delayed ACKs add ~40ms to every keep-alive request
+    wbufsize = 65536
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        with server._lock:
+            server.requests += 1
+            used = server.requests % server.ratelimit
+        body = server.routes.get(urlparse(self.path).path)
+        if server.latency:
+            time.sleep(server.latency)
+        status = 200 if body is not None else 404
+        if body is None:
+            body = json.dumps({"errors": [{"code": "not_found"}]}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Ratelimit-Limit", str(server.ratelimit))
+        self.send_header("X-Ratelimit-Remaining", str(server.ratelimit - used))
+        self.send_header("X-Ratelimit-Reset", "60")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        # warmup() opens connections with these; they aren't counted
+        # against the rate limit
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = _respond
+    do_POST = _respond
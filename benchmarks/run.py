@@ -0,0 +1,150 @@
+""" Run the client hot path benchmarks against a local mock exchange and
+record the results as JSON, so regressions show up as a diff.
+
+    python benchmarks/run.py -o bench_output.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from qtrade_client.api import QtradeAPI, _order_params  # noqa: E402
+from mock_exchange import MockExchange, make_common, make_tickers  # noqa: E402
+import bench_cli  # noqa: E402
+import bench_codec  # noqa: E402
+import bench_hmac  # noqa: E402
+import bench_prepared  # noqa: E402
+
+KEY = "1:1111111111111111111111111111111111111111111111111111111111111111"
+
+
+def best(fn, number, repeat=3):
+    """ Best seconds per call over `repeat` runs of `number` calls """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def bench_req(exchange):
+    api = QtradeAPI(exchange.endpoint, key=KEY)
+    api.get("/v1/user/balances")
+    # Time spent outside the socket is what the client controls, so compare
+    # a full request against the bare session call
+    full = best(lambda: api.get("/v1/user/balances"), 200)
+    url = exchange.endpoint + "/v1/user/balances"
+    bare = best(lambda: api.rs.get(url), 200)
+    return {"req_sec": full, "session_get_sec": bare, "req_overhead_sec": full - bare}
+
+
+def bench_warmup(exchange, repeat=20):
+    """ First request of a new client, cold and after warmup() """
+    def first(warm):
+        api = QtradeAPI(exchange.endpoint, key=KEY)
+        if warm:
+            api.warmup()
+        start = time.time()
+        api.markets[1]
+        api.get("/v1/user/balances")
+        return time.time() - start
+    return {"first_request_cold_sec": min(first(False) for _ in range(repeat)),
+            "first_request_warm_sec": min(first(True) for _ in range(repeat))}
+
+
+def bench_stream(n_orders=20000):
+    exchange = MockExchange(n_orders=n_orders).start()
+    try:
+        api = QtradeAPI(exchange.endpoint)
+        start = time.time()
+        api.get("/v1/user/orders")
+        full = time.time() - start
+        start = time.time()
+        records = api.iter_records("/v1/user/orders", "orders")
+        next(records)
+        first = time.time() - start
+        for _ in records:
+            pass
+        streamed = time.time() - start
+    finally:
+        exchange.stop()
+    return {"orders_{}_full_sec".format(n_orders): full,
+            "orders_{}_stream_first_record_sec".format(n_orders): first,
+            "orders_{}_stream_all_sec".format(n_orders): streamed}
+
+
+def bench_order():
+    market = {"id": 1, "string": "LTC_BTC", "taker_fee": "0.005", "maker_fee": "0"}
+    ticker = {"ask": "0.00707017", "bid": "0.00664751"}
+    return {
+        "order_params_sec": best(lambda: _order_params(
+            "buy_limit", "0.0065", market, ticker=ticker, value="0.01"), 20000),
+    }
+
+
+def bench_refresh(exchange):
+    api = QtradeAPI(exchange.endpoint)
+    common_body = json.dumps(make_common())
+    tickers_body = json.dumps(make_tickers())
+    return {
+        "load_common_sec": best(lambda: api._load_common(json.loads(common_body)), 200),
+        "load_tickers_sec": best(lambda: api._load_tickers(json.loads(tickers_body)), 200),
+        "refresh_common_http_sec": best(lambda: api._load_common(api.get("/v1/common")), 50),
+        "refresh_tickers_http_sec": best(lambda: api._load_tickers(api.get("/v1/tickers")), 50),
+    }
+
+
+def bench_cancel(latency=0.005, n_orders=300):
+    exchange = MockExchange(latency=latency, n_orders=n_orders).start()
+    try:
+        api = QtradeAPI(exchange.endpoint, key=KEY)
+        start = time.time()
+        report = api.cancel_all_orders()
+        elapsed = time.time() - start
+    finally:
+        exchange.stop()
+    assert len(report) == n_orders
+    return {"cancel_all_{}_orders_sec".format(n_orders): elapsed,
+            "cancel_latency_per_request_sec": latency}
+
+
+def run():
+    exchange = MockExchange().start()
+    try:
+        results = {}
+        results.update(bench_req(exchange))
+        results.update(bench_warmup(exchange))
+        results.update(bench_refresh(exchange))
+    finally:
+        exchange.stop()
+    results.update(bench_order())
+    results.update(bench_hmac.run())
+    results.update(bench_codec.run())
+    results.update(bench_prepared.run())
+    results.update(bench_cancel())
+    results.update(bench_stream())
+    results.update(bench_cli.run())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    args = parser.parse_args()
+    doc = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": int(time.time()),
+        "results": run(),
+    }
+    out = json.dumps(doc, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,64 @@
 import requests
+import requests.adapters
 import requests.auth
 import time
-import json as _json
+import threading
 try:
     from urllib.parse import urlparse, urljoin
 except ImportError:
      from urlparse import urlparse, urljoin
 import logging
 import base64
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 from hashlib import sha256
 from decimal import Decimal
 
+from .codec import default_codec
+from .metrics import lane_prometheus_lines
+from .records import Currency, Market, RecordIndex, Ticker, TickerColumns
+from .ratelimit import LANES, RequestScheduler, request_priority
+from .stream import iter_json_array
+
 log = logging.getLogger("qtrade")
+trace_log = logging.getLogger("qtrade.trace")
 
 COIN = Decimal('.00000001')
 
 
+def to_satoshi(value):
+    """ Convert a coin amount (str, Decimal or number) to integer satoshis """
+    if isinstance(value, str):
+        # Fast path for the plain decimal strings the API returns
+        whole, _, frac = value.partition('.')
+        if len(frac) <= 8:
+            try:
+                return int(whole + frac.ljust(8, '0'))
+            except ValueError:
+                pass
+    return int((Decimal(value) / COIN).to_integral_value())
+
+
+def from_satoshi(value):
+    """ Convert integer satoshis to a Decimal coin amount """
+    return Decimal(value) * COIN
+
+
+def _div_round(num, den):
+    """ num / den for positive integers, rounded half to even like
+    Decimal.quantize """
+    q, r = divmod(num, den)
+    if 2 * r > den or (2 * r == den and q % 2 == 1):
+        q += 1
+    return q
+
+
+# Error codes from /v1/user/cancel_order meaning the order is already closed
+CANCEL_GONE_ERRORS = frozenset(['not_found', 'order_not_open', 'order_closed'])
+
+
 class APIException(Exception):
 
     def __init__(self, message, code, errors):
@@ -25,78 +67,442 @@ class APIException(Exception):
         self.errors = errors
 
 
+def _request_uri(url, cache=None):
+    """ Path and query of `url`, the part of it that gets signed """
+    if cache is not None:
+        uri = cache.get(url)
+        if uri is not None:
+            return uri
+    url_obj = urlparse(url)
+    uri = url_obj.path
+    if url_obj.query:
+        uri += "?" + url_obj.query
+    if cache is not None:
+        # Query strings vary per call, so keep the cache from growing forever
+        if len(cache) >= 1024:
+            cache.clear()
+        cache[url] = uri
+    return uri
+
+
+def _sign(key, method, uri, timestamp, body):
+    """ Signature over the request details. `key` must be utf8 bytes and
+    `body` bytes, str or None. """
+    if body is None:
+        body = b""
+    elif not isinstance(body, bytes):
+        body = body.encode('utf8')
+    request_details = b"\n".join((
+        method.encode('utf8'), uri.encode('utf8'), timestamp.encode('utf8'), body, key))
+    return base64.b64encode(sha256(request_details).digest()).decode('utf8')
+
+
 def hmac_generate(key, url_path, method, body=None, _time=None):
     # modify and return the request
     now = time.time() if _time is None else _time
     timestamp = str(int(now))
-    url_obj = urlparse(url_path)
-
-    request_details = method + "\n"
-    uri = url_obj.path
-    if url_obj.query:
-        uri += "?" + url_obj.query
-    request_details += uri + "\n"
-    request_details += timestamp + "\n"
-    if body is not None:
-        if isinstance(body, str):
-            request_details += body + "\n"
-        else:
-            request_details += body.decode('utf8') + "\n"
-    else:
-        request_details += "\n"
-    request_details += key
-    hsh = sha256(request_details.encode("utf8")).digest()
-    signature = base64.b64encode(hsh)
-    return timestamp, signature.decode('utf8')
+    signature = _sign(key.encode('utf8'), method, _request_uri(url_path), timestamp, body)
+    return timestamp, signature
 
 
 class QtradeAuth(requests.auth.AuthBase):
 
     def __init__(self, key):
         self.key_id, self.key = key.split(":")
+        self._key = self.key.encode('utf8')
+        self._header_prefix = "HMAC-SHA256 {}:".format(self.key_id)
+        self._uri_cache = {}
 
     def __call__(self, req):
-        timestamp, signature = hmac_generate(self.key, req.url, req.method, body=req.body)
-        req.headers.update({
-            "Authorization": "HMAC-SHA256 {}:{}".format(self.key_id, signature),
-            "HMAC-Timestamp": timestamp
-        })
+        timestamp = str(int(time.time()))
+        signature = _sign(self._key, req.method, _request_uri(req.url, self._uri_cache),
+                          timestamp, req.body)
+        req.headers["Authorization"] = self._header_prefix + signature
+        req.headers["HMAC-Timestamp"] = timestamp
         return req
 
 
-class QtradeAPI(object):
-
-    def __init__(self, endpoint, origin=None, email='Unk', key=None):
+class PoolAdapter(requests.adapters.HTTPAdapter):
+    """ HTTPAdapter whose connections are created with `socket_options`, a
+    list of (level, option, value) tuples for setsockopt. None keeps
+    urllib3's defaults, which enable TCP_NODELAY. """
+
+    def __init__(self, socket_options=None, **kwargs):
+        # Set first; the base class builds the pool manager
+        self.socket_options = socket_options
+        super(PoolAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super(PoolAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.socket_options is not None:
+            proxy_kwargs['socket_options'] = self.socket_options
+        return super(PoolAdapter, self).proxy_manager_for(proxy, **proxy_kwargs)
+
+
+def _no_auth(req):
+    return req
+
+
+def _templatable(requests_kwargs, body):
+    """ Whether a request can be built from an endpoint template: no per
+    call session options beyond timeout, redirects and streaming, and an
+    already encoded body """
+    for key in ('cookies', 'files', 'auth', 'proxies', 'hooks', 'verify', 'cert'):
+        if requests_kwargs.get(key) is not None:
+            return False
+    return body is None or isinstance(body, bytes)
+
+
+def _check_market_args(market_id, market_string):
+    if market_id is not None and market_string is not None:
+        raise ValueError(
+            "market_id and market_string are mutually exclusive")
+    elif market_id is None and market_string is None:
+        raise ValueError("either market_id or market_string are required")
+
+
+def _check_order_args(value, amount, market_id, market_string):
+    _check_market_args(market_id, market_string)
+    if value is not None and amount is not None:
+        raise ValueError("value and amount are mutually exclusive")
+    elif value is None and amount is None:
+        raise ValueError("either value or amount are required")
+
+
+def _index_orders(orders):
+    """ Group orders by market id """
+    index = {}
+    for o in orders:
+        index.setdefault(o['market_id'], []).append(o)
+    return index
+
+
+def _cancel_result(exc=None):
+    """ Build a cancel report entry from the exception a cancel raised, if
+    any """
+    if exc is None:
+        return {"status": "cancelled"}
+    if isinstance(exc, APIException):
+        if exc.code == 404 or CANCEL_GONE_ERRORS.intersection(exc.errors):
+            return {"status": "gone", "code": exc.code, "errors": exc.errors}
+        return {"status": "failed", "code": exc.code, "errors": exc.errors}
+    return {"status": "failed", "code": None, "errors": [str(exc)]}
+
+
+def _fee_mult(market):
+    """ Multiplier converting a buy order's value into what it costs after
+    the worst case fee """
+    if isinstance(market, Market):
+        return market.fee_mult
+    fee_perc = max(Decimal(market['taker_fee']), Decimal(market['maker_fee']))
+    return Decimal(fee_perc+1)
+
+
+def _order_params(order_type, price, market, ticker=None, value=None, amount=None, fee_mult=None):
+    """ Compute the POST params for an order on `market`. If a `ticker` is
+    passed, returns None when the order would execute as a taker.
+    value = amount * price """
+    price = Decimal(price).quantize(COIN)
+    if ticker is not None:
+        if ticker['ask'] and order_type == "buy_limit" and price > Decimal(ticker['ask']):
+            log.info("%s %s at %s was not placed.  Ask price is %s, so it would have been a taker order.",
+                     market['id'], order_type, price, ticker['ask'])
+            return None
+        elif ticker['bid'] and order_type == 'sell_limit' and price < Decimal(ticker['bid']):
+            log.info("%s %s at %s was not placed.  Bid price is %s, so it would have been a taker order.",
+                     market['id'], order_type, price, ticker['bid'])
+            return None
+    # convert value to amount if necessary
+    if order_type == 'buy_limit' and value is not None:
+        if fee_mult is None:
+            fee_mult = _fee_mult(market)
+        amount = (Decimal(value) / (fee_mult * price)).quantize(COIN)
+    elif order_type == 'sell_limit' and value is not None:
+        amount = (Decimal(value) / price).quantize(COIN)
+    log.debug("Placing %s on %s market for %s at %s",
+              order_type, market['string'], amount, price)
+    return dict(amount=str(amount), price=str(price), market_id=market['id'])
+
+
+class _Payload(object):
+    """ Request or response payload for a log message. Rendered only if the
+    record is emitted, and cut to `limit` characters. `value` may be a
+    callable returning the payload. """
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        value = self.value() if callable(self.value) else self.value
+        if isinstance(value, bytes):
+            value = value.decode('utf8', 'replace')
+        elif not isinstance(value, str):
+            value = str(value)
+        if self.limit is not None and len(value) > self.limit:
+            return "{}... ({:,} chars)".format(value[:self.limit], len(value))
+        return value
+
+
+RequestTrace = namedtuple("RequestTrace", "method endpoint status bytes latency")
+
+
+def log_trace(trace):
+    """ A trace_hook that logs each request on the qtrade.trace logger """
+    trace_log.info("%s %s %s %dB %.1fms", trace.method, trace.endpoint, trace.status,
+                   trace.bytes, trace.latency * 1000)
+
+
+@contextmanager
+def _no_wait():
+    yield 0
+
+
+def _limiter_property(name):
+    """ Expose a field of self.limiter under its legacy rl_* name """
+    return property(lambda self: getattr(self.limiter, name),
+                    lambda self, v: setattr(self.limiter, name, v))
+
+
+def _book_takes(book, order_type, price):
+    if book.would_take(order_type, price):
+        log.info("%s %s at %s was not placed.  It would have crossed the book, so it would have been a taker order.",
+                 book.market_string, order_type, price)
+        return True
+    return False
+
+
+class QtradeBase(object):
+    """ State and response handling shared by the blocking and asyncio
+    clients. Subclasses provide the transport. """
+
+    def __init__(self, endpoint, origin=None, email='Unk', limiter=None):
         self.user_id = None
         self.email = email
         self.endpoint = endpoint
         self.origin = origin
         self.token = None
-        self.rs = requests.Session()
-        if key is not None:
-            self.set_hmac(key)
 
         self.tickers_update_interval = 180
         self.market_update_interval = 180
+        # Oldest snapshot of tickers or markets, in seconds, that may still be
+        # served while a newer one is fetched in the background. None to
+        # always refresh before returning once the update interval is up
+        self.max_staleness = None
+        # Number of requests bulk operations keep in flight at once
+        self.bulk_workers = 8
 
         self._markets_map = None
         self._markets_age = 0
         self._tickers = None
         self._tickers_age = 0
+        # (tickers snapshot, TickerColumns built from it)
+        self._ticker_columns = (None, None)
+        # OrderBooks by market id. prevent_taker checks orders against these
+        # instead of the tickers, refreshing any older than book_max_age
+        self.books = {}
+        self.book_max_age = 2
+        # Encodes request bodies and decodes responses
+        self.codec = default_codec()
+        # Longest payload in characters put in log messages. None for no limit
+        self.log_payload_limit = 2000
+        # Called with a RequestTrace after every request, e.g. log_trace
+        self.trace_hook = None
+        # A metrics.Metrics to record latency, rate limit sleeps and errors
+        self.metrics = None
         self.honor_ratelimit = True
-        self.rl_remaining = 99
-        self.rl_reset_at = time.time()
-        self.rl_limit = 120
-        # Set to 1 to disable soft threshold, 0 will always sleep between calls
-        # if needed (no burst at all)
-        self.rl_soft_threshold = 0.5
+        # Pass the same limiter to every client using one API key so they
+        # share its budget
+        self.scheduler = RequestScheduler(limiter)
+
+    @property
+    def limiter(self):
+        return self.scheduler.limiter
+
+    @limiter.setter
+    def limiter(self, limiter):
+        self.scheduler.limiter = limiter
+
+    rl_remaining = _limiter_property("remaining")
+    rl_reset_at = _limiter_property("reset_at")
+    rl_limit = _limiter_property("limit")
+    rl_soft_threshold = _limiter_property("soft_threshold")
+
+    def _ratelimit_wait(self, method, endpoint, priority=None):
+        """ Context manager yielding the number of seconds to wait before
+        sending a request. The priority lane defaults to request_priority """
+        if priority is None:
+            priority = request_priority(method, endpoint)
+        if not self.honor_ratelimit:
+            return _no_wait()
+        return self.scheduler.lane(priority)
+
+    def _payload(self, value):
+        return _Payload(value, self.log_payload_limit)
+
+    def _trace(self, method, endpoint, status, nbytes, started):
+        latency = time.time() - started
+        if self.metrics is not None:
+            self.metrics.record_request(method.upper(), endpoint, latency)
+        if self.trace_hook is not None:
+            self.trace_hook(RequestTrace(method.upper(), endpoint, status, nbytes, latency))
+
+    def _record_sleep(self, method, endpoint, priority, seconds):
+        if self.metrics is not None and seconds > 0:
+            if priority is None:
+                priority = request_priority(method, endpoint)
+            self.metrics.record_sleep(LANES[priority], seconds)
+
+    def metrics_snapshot(self):
+        """ Dict of everything self.metrics has recorded, plus the
+        scheduler's lane stats. Just the lane stats if metrics is None. """
+        if self.metrics is None:
+            return {"lanes": self.scheduler.stats()}
+        return self.metrics.snapshot(self.scheduler.stats())
+
+    def metrics_prometheus(self):
+        """ metrics_snapshot() in the Prometheus text format """
+        if self.metrics is None:
+            return "\n".join(lane_prometheus_lines(self.scheduler.stats())) + "\n"
+        return self.metrics.prometheus(self.scheduler.stats())
+
+    def _ratelimit_update(self, headers):
+        self.limiter.update(headers)
+
+    def _freshness(self, snapshot, loaded_at, interval, max_age=None):
+        """ "fresh" while a snapshot is within its update interval, "stale"
+        once it is due for a refresh but may still be served, and "expired"
+        when it must be refreshed before use. `max_age` overrides
+        max_staleness. """
+        if snapshot is None:
+            return "expired"
+        age = time.time() - loaded_at
+        if max_age is None:
+            max_age = self.max_staleness
+        if max_age is not None and age > max_age:
+            return "expired"
+        if age <= interval:
+            return "fresh"
+        return "expired" if max_age is None else "stale"
+
+    def _columns_for(self, tickers):
+        """ TickerColumns for a tickers snapshot, built the first time they
+        are asked for and reused until the snapshot is replaced """
+        source, columns = self._ticker_columns
+        if source is not tickers:
+            columns = TickerColumns(tickers.values())
+            self._ticker_columns = (tickers, columns)
+        return columns
+
+    def _tickers_freshness(self, max_age=None):
+        return self._freshness(self._tickers, self._tickers_age,
+                               self.tickers_update_interval, max_age)
+
+    def _common_freshness(self, max_age=None):
+        return self._freshness(self._markets_map, self._markets_age,
+                               self.market_update_interval, max_age)
+
+    def _load_tickers(self, res, fetched_at=None):
+        """ Load a /v1/tickers response fetched at `fetched_at`, default now """
+        tickers = RecordIndex((Ticker(m) for m in res['markets']), 'id_hr')
+        # Readers on other threads see either the old map or the new one
+        self._tickers, self._tickers_age = tickers, fetched_at or time.time()
+
+    def _load_common(self, common, fetched_at=None):
+        """ Load a /v1/common response fetched at `fetched_at`, default now """
+        currencies = {c['code']: Currency(c) for c in common['currencies']}
+        # Markets reference their currencies' records rather than copies
+        markets = RecordIndex((Market(m, currencies) for m in common['markets']), 'string')
+        self._currencies_map = currencies
+        self._markets_map, self._markets_age = markets, fetched_at or time.time()
+
+    def _handle_response(self, method, endpoint, status_code, silent_codes, req_body, decode, text):
+        """ Turn a finished response into its data or raise APIException.
+        `req_body` is the encoded request body, `decode` returns the parsed
+        JSON response and `text` is the raw response, or a callable returning
+        it, for logging. """
+        started = time.time()
+        try:
+            ret = decode()
+        except Exception:
+            if status_code > 299:
+                log.warning("%s %s %s req=%s res=\n%s", method, endpoint, status_code,
+                            self._payload(req_body), self._payload(text))
+                if self.metrics is not None:
+                    self.metrics.record_error(status_code, [])
+                raise APIException(
+                    "Invalid return code from backend", status_code, [])
+            else:
+                return True
+
+        if self.metrics is not None:
+            self.metrics.record_decode(endpoint, time.time() - started)
+
+        if status_code > 299:
+            if status_code not in silent_codes:
+                log.warning("%s %s %s req=%s res=\n%s", method, endpoint, status_code,
+                            self._payload(req_body), self._payload(text))
+            errors = [e['code'] for e in ret['errors']]
+            if self.metrics is not None:
+                self.metrics.record_error(status_code, errors)
+            raise APIException(
+                "Invalid return code from backend", status_code, errors)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s %s req=%s res=%s", method.upper(), endpoint,
+                      self._payload(req_body), self._payload(ret))
+        return ret['data']
+
+
+class QtradeAPI(QtradeBase):
+
+    def __init__(self, endpoint, origin=None, email='Unk', key=None, limiter=None,
+                 pool_size=requests.adapters.DEFAULT_POOLSIZE, keep_alive=True, socket_options=None):
+        super(QtradeAPI, self).__init__(endpoint, origin=origin, email=email, limiter=limiter)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.socket_options = socket_options
+        self.rs = requests.Session()
+        # pool_size connections are kept open per host for reuse
+        self.adapter = PoolAdapter(socket_options=socket_options, pool_maxsize=pool_size)
+        self.rs.mount("https://", self.adapter)
+        self.rs.mount("http://", self.adapter)
+        if not keep_alive:
+            self.rs.headers['Connection'] = 'close'
+        self._refresh_locks = {"tickers": threading.Lock(), "common": threading.Lock()}
+        # Share one request between threads making the same GET at once.
+        # The data returned is then shared too, so don't modify it
+        self.coalesce_gets = False
+        # Seconds to reuse a GET's data for, by endpoint, e.g.
+        # {"/v1/tickers": 1}. Implies coalesce_gets for those endpoints
+        self.get_cache_ttl = {}
+        self._inflight = {}
+        self._get_cache = {}
+        self._inflight_lock = threading.Lock()
+        # Build requests from a cached per-endpoint template and send them
+        # with Session.send, skipping Session.request's per-call merging.
+        # Templates snapshot the session's headers, cookies, hooks and
+        # environment (proxies, CA bundle); call clear_request_templates()
+        # after changing any of those
+        self.prepared_requests = False
+        self._templates = {}
+        # Seconds warmup() gives each connection to open
+        self.warmup_timeout = 10
+        if key is not None:
+            self.set_hmac(key)
 
     def clone(self):
         """ Returns a new QtradeAPI instance with stripped auth but the same
         endpoint configuration. Useful for testing toolchains that might point
         at multiple testing endpoints and 'inherit' from some base endpoint
         config """
-        return type(self)(self.endpoint)
+        return type(self)(self.endpoint, pool_size=self.pool_size, keep_alive=self.keep_alive,
+                          socket_options=self.socket_options)
 
     def login(self, email, password):
         """ Login with username and password to get a JWT token.
@@ -112,6 +518,60 @@ class QtradeAPI(object):
         """ hmac_pair should be in "1:11111..." format, with keyid then key """
         self.rs.auth = QtradeAuth(hmac_pair)
 
+    def clear_request_templates(self):
+        self._templates = {}
+
+    def warmup(self, connections=None):
+        """ Open `connections` (default bulk_workers) keep-alive connections
+        to the endpoint, with DNS, TCP and TLS setup done, and load markets
+        and tickers, so the first latency critical request finds both ready.
+        The connections are opened by concurrent HEAD requests to the
+        endpoint, which skip the client's rate limit pacing. Returns the
+        number of those requests that got a response. """
+        if connections is None:
+            connections = self.bulk_workers
+        opened = 0
+        if self.keep_alive:
+            # More than pool_size would be closed again on return to the pool
+            opened = self._open_connections(min(connections, self.pool_size))
+        self._refresh_common()
+        self._refresh_tickers()
+        return opened
+
+    def _open_connections(self, n):
+        if n <= 0:
+            return 0
+        url = self.endpoint
+        responses = []
+        lock = threading.Lock()
+        all_sent = threading.Event()
+
+        def head(_):
+            res = None
+            try:
+                res = self.rs.head(url, stream=True, timeout=self.warmup_timeout)
+            except Exception as e:
+                # Anything from a refused connection to a missing CA bundle
+                log.warning("Warmup connection to %s failed: %s", url, e)
+            finally:
+                with lock:
+                    responses.append(res)
+                    if len(responses) == n:
+                        all_sent.set()
+            # Streamed responses hold their connection until read, so no
+            # request can reuse another's and each opens its own
+            all_sent.wait(self.warmup_timeout)
+            if res is not None:
+                res.content
+                res.close()
+                # If the exchange counts HEAD requests, keep the limiter
+                # in step with it
+                if 'X-Ratelimit-Remaining' in res.headers:
+                    self._ratelimit_update(res.headers)
+            return res is not None
+        with ThreadPoolExecutor(max_workers=n) as workers:
+            return sum(workers.map(head, range(n)))
+
     def balances(self):
         return {b['currency']: Decimal(b['balance']) for b in self.get("/v1/user/balances")['balances']}
 
@@ -129,41 +589,105 @@ class QtradeAPI(object):
     def order(self, order_type, price, value=None, amount=None, market_id=None, market_string=None, prevent_taker=False):
         """ Place an order with the given parameters.
         value = amount * price """
-        if market_id is not None and market_string is not None:
-            raise ValueError(
-                "market_id and market_string are mutually exclusive")
-        elif market_id is None and market_string is None:
-            raise ValueError("either market_id or market_string are required")
-        if value is not None and amount is not None:
-            raise ValueError("value and amount are mutually exclusive")
-        elif value is None and amount is None:
-            raise ValueError("either value or amount are required")
-
-        if market_string is not None:
-            market_id = self.markets[market_string]['id']
-        price = Decimal(price).quantize(COIN)
+        _check_order_args(value, amount, market_id, market_string)
+        market = self.markets[market_id if market_string is None else market_string]
+        ticker = None
         if prevent_taker is True:
-            ticker = self.tickers[market_id]
-            if ticker['ask'] and order_type == "buy_limit" and price > Decimal(ticker['ask']):
-                log.info("%s %s at %s was not placed.  Ask price is %s, so it would have been a taker order.",
-                         market_id, order_type, price, ticker['ask'])
+            book = self._tracked_book(market['id'])
+            if book is None:
+                ticker = self.tickers[market['id']]
+            elif _book_takes(book, order_type, price):
                 return "order not placed"
-            elif ticker['bid'] and order_type == 'sell_limit' and price < Decimal(ticker['bid']):
-                log.info("%s %s at %s was not placed.  Bid price is %s, so it would have been a taker order.",
-                         market_id, order_type, price, ticker['bid'])
-                return "order not placed"
-        # convert value to amount if necessary
-        if order_type == 'buy_limit' and value is not None:
-            fee_perc = max(Decimal(self.markets[market_id]['taker_fee']), Decimal(
-                self.markets[market_id]['maker_fee']))
-            fee_mult = Decimal(fee_perc+1)
-            amount = (Decimal(value) / (fee_mult * price)).quantize(COIN)
-        elif order_type == 'sell_limit' and value is not None:
-            amount = (Decimal(value) / price).quantize(COIN)
-        logging.debug("Placing %s on %s market for %s at %s",
-                      order_type, self.markets[market_id]['string'], amount, price)
-        return self.post('/v1/user/{}'.format(order_type), amount=str(amount),
-                         price=str(price), market_id=market_id)
+        params = _order_params(order_type, price, market, ticker=ticker,
+                               value=value, amount=amount)
+        if params is None:
+            return "order not placed"
+        return self.post('/v1/user/{}'.format(order_type), **params)
+
+    def place_orders(self, specs):
+        """ Place many orders at once. Each spec is a dict of keyword
+        arguments for `order`. All specs are validated and priced before any
+        order is sent, so a bad spec raises ValueError without placing
+        anything. Every order is sent before this returns, with up to
+        bulk_workers in flight; the iterator returned yields (spec index,
+        result) pairs in completion order. The result is what `order` would
+        have returned, or the exception the order raised. """
+        specs = list(specs)
+        for spec in specs:
+            _check_order_args(spec.get('value'), spec.get('amount'),
+                              spec.get('market_id'), spec.get('market_string'))
+        markets = self.markets
+        tickers = None
+        books = {}
+        fee_mults = {}
+        prepared = []
+        for spec in specs:
+            market_key = spec.get('market_id')
+            if market_key is None:
+                market_key = spec['market_string']
+            market = markets[market_key]
+            if market['id'] not in fee_mults:
+                fee_mults[market['id']] = _fee_mult(market)
+            ticker = None
+            if spec.get('prevent_taker') is True:
+                if market['id'] not in books:
+                    books[market['id']] = self._tracked_book(market['id'])
+                book = books[market['id']]
+                if book is None:
+                    if tickers is None:
+                        tickers = self.tickers
+                    ticker = tickers[market['id']]
+                elif _book_takes(book, spec['order_type'], spec['price']):
+                    prepared.append(None)
+                    continue
+            prepared.append(_order_params(
+                spec['order_type'], spec['price'], market, ticker=ticker,
+                value=spec.get('value'), amount=spec.get('amount'),
+                fee_mult=fee_mults[market['id']]))
+        return self._submit_orders(specs, prepared)
+
+    def track_book(self, market_string):
+        """ Start keeping a local OrderBook for a market. Orders placed with
+        prevent_taker on it are then checked against the book. """
+        from .orderbook import OrderBook
+        book = OrderBook(self, market_string)
+        book.refresh()
+        self.books[self.markets[market_string]['id']] = book
+        return book
+
+    def _tracked_book(self, market_id):
+        """ The market's OrderBook, refreshed if older than book_max_age, or
+        None if it isn't tracked """
+        book = self.books.get(market_id)
+        if book is not None and book.age > self.book_max_age:
+            book.refresh()
+        return book
+
+    def _submit_orders(self, specs, prepared):
+        """ Send every prepared order now and return an iterator over the
+        results as they complete """
+        def submit(i):
+            try:
+                return self.post('/v1/user/{}'.format(specs[i]['order_type']), **prepared[i])
+            except Exception as e:
+                return e
+
+        skipped = [(i, "order not placed") for i, params in enumerate(prepared) if params is None]
+        pending = [i for i, params in enumerate(prepared) if params is not None]
+        if not pending:
+            return iter(skipped)
+        pool = ThreadPoolExecutor(max_workers=min(self.bulk_workers, len(pending)))
+        futures = {pool.submit(submit, i): i for i in pending}
+        # The workers exit once the queued orders are sent, whether or not
+        # the results are ever read
+        pool.shutdown(wait=False)
+
+        def results():
+            for item in skipped:
+                yield item
+            for fut in as_completed(futures):
+                yield futures[fut], fut.result()
+        return results()
 
     def balances_merged(self):
         """ Get total balances including order balances """
@@ -171,7 +695,7 @@ class QtradeAPI(object):
         merged = {}
         for k, v in list(bals['spendable'].items()) + list(bals['in_orders'].items()):
             merged.setdefault(k, 0)
-            merged[k] += Decimal(v)
+            merged[k] += v
         return merged
 
     def balances_all(self):
@@ -181,21 +705,41 @@ class QtradeAPI(object):
             "in_orders": {b['currency']: Decimal(b['balance']) for b in all_bal['order_balances']},
         }
 
+    def cancel_orders(self, order_ids):
+        """ Cancel many orders at once, keeping up to bulk_workers cancels in
+        flight. Returns a report mapping each order id to a dict with a
+        "status" of "cancelled", "gone" (already closed) or "failed", plus the
+        APIException "code" and "errors" when the cancel was rejected. """
+        order_ids = list(order_ids)
+        workers = self.bulk_workers
+        # Don't fan out further than the rate limit budget we have left
+        if self.honor_ratelimit:
+            workers = min(workers, max(1, self.rl_remaining))
+
+        def cancel(order_id):
+            try:
+                self.post('/v1/user/cancel_order', json={'id': order_id})
+            except Exception as e:
+                return _cancel_result(e)
+            return _cancel_result()
+
+        if workers <= 1 or len(order_ids) <= 1:
+            return {i: cancel(i) for i in order_ids}
+        with ThreadPoolExecutor(max_workers=min(workers, len(order_ids))) as pool:
+            return dict(zip(order_ids, pool.map(cancel, order_ids)))
+
     def cancel_all_orders(self):
-        for o in self.orders(open=True):
-            self.post('/v1/user/cancel_order', json={'id': o['id']})
+        """ Cancel every open order. Returns a report as cancel_orders does """
+        return self.cancel_orders(o['id'] for o in self.orders(open=True))
 
     def cancel_market_orders(self, market_string=None, market_id=None):
-        if market_id is not None and market_string is not None:
-            raise ValueError(
-                "market_id and market_string are mutually exclusive")
-        elif market_id is None and market_string is None:
-            raise ValueError("either market_id or market_string are required")
+        """ Cancel every open order on one market. Returns a report as
+        cancel_orders does """
+        _check_market_args(market_id, market_string)
         if market_id is None:
             market_id = self.markets[market_string]['id']
-        for o in self.orders(open=True):
-            if o['market_id'] == market_id:
-                self.post('/v1/user/cancel_order', json={'id': o['id']})
+        index = _index_orders(self.orders(open=True))
+        return self.cancel_orders(o['id'] for o in index.get(market_id, []))
 
     @property
     def tickers(self):
@@ -203,13 +747,23 @@ class QtradeAPI(object):
         self._refresh_tickers()
         return self._tickers
 
-    def _refresh_tickers(self):
+    def fresh_tickers(self, max_age):
+        """ Tickers no more than `max_age` seconds old, fetching them first
+        if the current snapshot is older """
+        self._refresh_tickers(max_age)
+        return self._tickers
+
+    @property
+    def ticker_columns(self):
+        """ The tickers as a TickerColumns, e.g. for computing every
+        market's spread at once with ticker_columns.as_numpy() """
+        self._refresh_tickers()
+        return self._columns_for(self._tickers)
+
+    def _refresh_tickers(self, max_age=None):
         """ Lazy load and reload every tickers_update_interval. """
-        if self._tickers is None or (time.time() - self._tickers_age) > self.tickers_update_interval:
-            res = self.get('/v1/tickers')
-            self._tickers = {m['id']: m for m in res['markets']}
-            self._tickers.update({m['id_hr']: m for m in res['markets']})
-            self._tickers_age = time.time()
+        self._revalidate("tickers", lambda: self._tickers_freshness(max_age),
+                         lambda: self._load_tickers(self.get('/v1/tickers')))
 
     @property
     def currencies(self):
@@ -222,37 +776,156 @@ class QtradeAPI(object):
         self._refresh_common()
         return self._markets_map
 
-    def _refresh_common(self):
+    def fresh_markets(self, max_age):
+        """ Markets no more than `max_age` seconds old, fetching them first
+        if the current snapshot is older """
+        self._refresh_common(max_age)
+        return self._markets_map
+
+    def _refresh_common(self, max_age=None):
         """ Lazy load and reload every market_update_interval. """
-        if self._markets_map is None or (time.time() - self._markets_age) > self.market_update_interval:
-            # Index our market information by market string
-            common = self.get("/v1/common")
-            self._currencies_map = {c['code']: c for c in common['currencies']}
-            # Set some convenience keys so we can pass around just the dict
-            for m in common['markets']:
-                m['string'] = "{market_currency}_{base_currency}".format(**m)
-                m['base_currency'] = self._currencies_map[m['base_currency']]
-                m['market_currency'] = self._currencies_map[m['market_currency']]
-            self._markets_map = {m['string']: m for m in common['markets']}
-            self._markets_map.update({m['id']: m for m in common['markets']})
-            self._markets_age = time.time()
-
-    def _req(self, method, endpoint, silent_codes=[], headers={}, json=None, params=None, is_retry=False, **kwargs):
-        soft_limit = int(self.rl_limit * (1 - self.rl_soft_threshold))
-        # If limit is completely exhausted, sleep until full reset. Clamp to
-        # min 0 to not bomb out if reset_at is in past
-        if self.honor_ratelimit and self.rl_remaining <= 0:
-            must_wait = max(0, self.rl_reset_at - time.time())
-            if must_wait >= 5:
-                log.info("Ratelimit hit, sleeping for {:,}".format(must_wait))
-            time.sleep(must_wait)
-
-        # If limit is >self.rl_soft_threshold % used, sleep the appropriate
-        # amount to avoid hitting a big wait
-        elif self.honor_ratelimit and self.rl_remaining <= soft_limit:
-            sec_to_reset = self.rl_reset_at - time.time()
-            must_wait = max(0, sec_to_reset / float(self.rl_remaining))
-            time.sleep(must_wait)
+        self._revalidate("common", lambda: self._common_freshness(max_age),
+                         lambda: self._load_common(self.get("/v1/common")))
+
+    def _revalidate(self, name, freshness, load):
+        """ Run `load` now if the snapshot has expired, or on a background
+        thread if it is only stale. Concurrent callers share one fetch. """
+        state = freshness()
+        if state == "fresh":
+            return
+        lock = self._refresh_locks[name]
+        if state == "stale":
+            # Whoever holds the lock is already fetching a new snapshot
+            if lock.acquire(False):
+                thread = threading.Thread(target=self._background_load,
+                                          args=(lock, freshness, load))
+                thread.daemon = True
+                thread.start()
+            return
+        with lock:
+            if freshness() != "fresh":
+                load()
+
+    def _background_load(self, lock, freshness, load):
+        try:
+            if freshness() != "fresh":
+                load()
+        except Exception:
+            log.warning("Background refresh failed", exc_info=True)
+        finally:
+            lock.release()
+
+    def iter_records(self, endpoint, key, **params):
+        """ GET `endpoint` and yield the items of its data[key] array as they
+        are parsed off the wire, e.g. iter_records("/v1/tickers", "markets").
+        Memory use stays flat however long the array is. """
+        res, req_body = self._send('get', endpoint, params=params, stream=True)
+        try:
+            if res.status_code > 299:
+                self._handle_response('get', endpoint, res.status_code, [], req_body,
+                                      lambda: self.codec.loads(res.content), lambda: res.text)
+            for record in iter_json_array(res.iter_content(chunk_size=16384), ("data", key)):
+                yield record
+        finally:
+            res.close()
+
+    def _req(self, method, endpoint, silent_codes=[], **kwargs):
+        if method.lower() == 'get' and not kwargs.get('stream') and (
+                self.coalesce_gets or endpoint in self.get_cache_ttl):
+            return self._coalesced_get(endpoint, silent_codes, kwargs)[0]
+        return self._req_once(method, endpoint, silent_codes, **kwargs)
+
+    def _coalesced_get(self, endpoint, silent_codes, kwargs, max_age=None):
+        """ GET through the micro-cache, joining an identical GET already in
+        flight on another thread instead of sending a second one. Returns
+        the data and the time it was fetched. Cached data older than
+        `max_age` seconds is fetched again. """
+        # The lane doesn't change the response, so it isn't part of the key
+        key = (endpoint, repr(sorted((k, v) for k, v in kwargs.items() if k != 'priority')))
+        ttl = self.get_cache_ttl.get(endpoint)
+        with self._inflight_lock:
+            if ttl:
+                cached = self._get_cache.get(key)
+                now = time.time()
+                if cached is not None and cached[0] > now and (
+                        max_age is None or now - cached[1][1] <= max_age):
+                    return cached[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            started = time.time()
+            result = (self._req_once('get', endpoint, silent_codes, **kwargs), started)
+        except BaseException as e:
+            # Even KeyboardInterrupt must release the threads waiting on us
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+                if ttl and not future.exception():
+                    now = time.time()
+                    if len(self._get_cache) > 256:
+                        self._get_cache = {k: v for k, v in self._get_cache.items() if v[0] > now}
+                    self._get_cache[key] = (now + ttl, future.result())
+
+    def _template(self, method, endpoint):
+        """ The prepared request every (method, endpoint) call starts from,
+        and the environment settings to send it with """
+        key = (method, endpoint)
+        template = self._templates.get(key)
+        if template is None:
+            url = urljoin(self.endpoint, endpoint)
+            # Auth is applied per call, once the body is known
+            prepared = self.rs.prepare_request(
+                requests.Request(method.upper(), url, auth=_no_auth))
+            settings = self.rs.merge_environment_settings(url, {}, None, None, None)
+            template = self._templates[key] = (prepared, settings)
+        return template
+
+    def _send_prepared(self, method, endpoint, headers, body, params, requests_kwargs):
+        """ Session.request, but with the URL, session settings and
+        environment taken from the endpoint's template """
+        template, settings = self._template(method, endpoint)
+        req = template.copy()
+        if params and any(v is not None for v in params.values()):
+            req.prepare_url(req.url, params)
+        if body is not None:
+            req.body = body
+            req.headers['Content-Length'] = str(len(body))
+        req.headers.update(headers)
+        if self.rs.auth is not None:
+            req = self.rs.auth(req)
+        send_kwargs = dict(settings, timeout=requests_kwargs.get('timeout'),
+                           allow_redirects=requests_kwargs.get('allow_redirects'))
+        if requests_kwargs.get('stream') is not None:
+            send_kwargs['stream'] = requests_kwargs['stream']
+        return self.rs.send(req, **send_kwargs)
+
+    def _req_once(self, method, endpoint, silent_codes=[], **kwargs):
+        res, req_body = self._send(method, endpoint, **kwargs)
+        if kwargs.get('stream') is True:
+            log.debug("GET streaming %s", endpoint)
+            for ln in res.iter_lines():
+                print(ln.decode('utf8'))
+            return
+
+        return self._handle_response(method, endpoint, res.status_code, silent_codes, req_body,
+                                     lambda: self.codec.loads(res.content), lambda: res.text)
+
+    def _send(self, method, endpoint, headers={}, json=None, params=None, is_retry=False, priority=None, **kwargs):
+        """ Send a request once the rate limit allows, retrying once on 429.
+        Returns the response and the encoded request body. """
+        with self._ratelimit_wait(method, endpoint, priority) as must_wait:
+            if must_wait > 0:
+                time.sleep(must_wait)
+        self._record_sleep(method, endpoint, priority, must_wait)
 
         # Inject the auth token header if applicable
         if self.token:
@@ -265,52 +938,43 @@ class QtradeAPI(object):
         for key in requests_kwarg_keys:
             requests_kwargs[key] = kwargs.pop(key, None)
 
-        url = urljoin(self.endpoint, endpoint)
-
         # Support legacy usage of the json parameter, but prefer passing POST
         # params as kwargs
         if method.lower() == "post" and json is None:
             json = kwargs
-        req_json = _json.dumps(json)
+        # Encode the body once; the same bytes are sent, signed and logged
+        body = requests_kwargs.pop('data')
+        if body is None and json is not None:
+            body = self.codec.dumps(json)
+            headers = dict(headers, **{'Content-Type': 'application/json'})
 
         # Support passing params just because...
         if method.lower() == "get" and params is None:
             params = kwargs
 
-        res = self.rs.request(method, url, headers=headers,
-                              json=json, params=params, **requests_kwargs)
-        self.rl_reset_at = time.time() + int(res.headers.get('X-Ratelimit-Reset', 0))
-        self.rl_limit = int(res.headers.get('X-Ratelimit-Limit', 100))
-        self.rl_remaining = int(res.headers.get('X-Ratelimit-Remaining', 99))
-        if requests_kwargs.get('stream') is True:
-            log.debug("GET streaming {}".format(endpoint))
-            for ln in res.iter_lines():
-                print(ln.decode('utf8'))
-            return
+        started = time.time()
+        if self.prepared_requests and _templatable(requests_kwargs, body):
+            res = self._send_prepared(method, endpoint, headers, body, params, requests_kwargs)
+        else:
+            res = self.rs.request(method, urljoin(self.endpoint, endpoint), headers=headers,
+                                  data=body, params=params, **requests_kwargs)
+        self._ratelimit_update(res.headers)
+        if self.trace_hook is not None or self.metrics is not None:
+            # Don't pull a streamed body in just to measure it
+            if requests_kwargs.get('stream'):
+                nbytes = int(res.headers.get('Content-Length', 0))
+            else:
+                nbytes = len(res.content)
+            self._trace(method, endpoint, res.status_code, nbytes, started)
 
         # We've hit the rate limit, so retry. Code at beginning of call
         # will proc now that we've populated rl_limit, etc
         if res.status_code == 429 and is_retry is False:
-            return self._req(method, endpoint, silent_codes=silent_codes, headers=headers, json=json, params=params, is_retry=True, **kwargs)
-
-        try:
-            ret = res.json()
-        except Exception:
-            if res.status_code > 299:
-                log.warning("{} {} {} req={} res=\n{}".format(
-                    method, endpoint, res.status_code, req_json, res.text))
-                raise APIException(
-                    "Invalid return code from backend", res.status_code, [])
-            else:
-                return True
-
-        if res.status_code > 299:
-            if res.status_code not in silent_codes:
-                log.warning("{} {} {} req={} res=\n{}".format(
-                    method, endpoint, res.status_code, req_json, res.text))
-            errors = [e['code'] for e in ret['errors']]
-            raise APIException(
-                "Invalid return code from backend", res.status_code, errors)
-
-        log.debug("GET {} req={} res={}".format(endpoint, req_json, ret))
-        return ret['data']
+            if self.metrics is not None:
+                self.metrics.record_retry()
+            res.close()
+            requests_kwargs = {k: v for k, v in requests_kwargs.items() if v is not None}
+            return self._send(method, endpoint, headers=headers, params=params, data=body,
+                              is_retry=True, priority=priority, **requests_kwargs)
+
+        return res, body
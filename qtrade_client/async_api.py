@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal
+try:
+    from urllib.parse import urlencode, urljoin
+except ImportError:
+    from urllib import urlencode
+    from urlparse import urljoin
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .api import (QtradeBase, hmac_generate, _cancel_result, _check_market_args,
+                  _check_order_args, _index_orders, _order_params)
+from .poller import Poller
+
+log = logging.getLogger("qtrade")
+
+
+class AsyncQtradeAPI(QtradeBase):
+    """ asyncio twin of QtradeAPI. Every request method is a coroutine, and
+    all requests share one keep-alive connection pool of at most `pool_size`
+    connections. Requires aiohttp. """
+
+    def __init__(self, endpoint, origin=None, email='Unk', key=None,
+                 pool_size=100, keepalive_timeout=30, limiter=None):
+        super(AsyncQtradeAPI, self).__init__(endpoint, origin=origin, email=email, limiter=limiter)
+        self.key_id = None
+        self.key = None
+        if key is not None:
+            self.set_hmac(key)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        # Serializes lazy reloads of markets and tickers so concurrent tasks
+        # don't all fetch them at once
+        self._refresh_locks = {}
+        # Background refreshes in flight, held so they aren't collected
+        self._refresh_tasks = {}
+
+    def clone(self):
+        """ Returns a new AsyncQtradeAPI instance with stripped auth but the
+        same endpoint configuration. """
+        return type(self)(self.endpoint, pool_size=self.pool_size,
+                          keepalive_timeout=self.keepalive_timeout)
+
+    def set_hmac(self, hmac_pair):
+        """ hmac_pair should be in "1:11111..." format, with keyid then key """
+        self.key_id, self.key = hmac_pair.split(":")
+
+    def _get_session(self):
+        if self._session is None:
+            if aiohttp is None:
+                raise ImportError("AsyncQtradeAPI requires aiohttp")
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def login(self, email, password):
+        """ Login with username and password to get a JWT token.
+        Intended for internal testing only. """
+        resp = await self._req('post', "/v1/login", json={
+            "email": email,
+            "password": password,
+        })
+        self.user_id = resp['user_id']
+        self.token = resp['token']
+
+    async def balances(self):
+        return {b['currency']: Decimal(b['balance']) for b in (await self.get("/v1/user/balances"))['balances']}
+
+    async def get(self, endpoint, *args, **kwargs):
+        return await self._req('get', endpoint, *args, **kwargs)
+
+    async def post(self, endpoint, *args, **kwargs):
+        return await self._req('post', endpoint, *args, **kwargs)
+
+    async def orders(self, open=None, older_than=None, newer_than=None):
+        if isinstance(open, bool):
+            open = str(open).lower()
+        return (await self.get("/v1/user/orders", open=open, older_than=older_than, newer_than=newer_than))['orders']
+
+    async def order(self, order_type, price, value=None, amount=None, market_id=None, market_string=None, prevent_taker=False):
+        """ Place an order with the given parameters.
+        value = amount * price """
+        _check_order_args(value, amount, market_id, market_string)
+        market = (await self.markets())[market_id if market_string is None else market_string]
+        ticker = (await self.tickers())[market['id']] if prevent_taker is True else None
+        params = _order_params(order_type, price, market, ticker=ticker,
+                               value=value, amount=amount)
+        if params is None:
+            return "order not placed"
+        return await self.post('/v1/user/{}'.format(order_type), **params)
+
+    async def balances_merged(self):
+        """ Get total balances including order balances """
+        bals = await self.balances_all()
+        merged = {}
+        for k, v in list(bals['spendable'].items()) + list(bals['in_orders'].items()):
+            merged.setdefault(k, 0)
+            merged[k] += v
+        return merged
+
+    async def balances_all(self):
+        all_bal = await self.get("/v1/user/balances_all")
+        return {
+            "spendable": {b['currency']: Decimal(b['balance']) for b in all_bal['balances']},
+            "in_orders": {b['currency']: Decimal(b['balance']) for b in all_bal['order_balances']},
+        }
+
+    async def cancel_orders(self, order_ids):
+        """ Cancel many orders concurrently, at most bulk_workers at a time.
+        Returns the same report as QtradeAPI.cancel_orders """
+        order_ids = list(order_ids)
+        limit = asyncio.Semaphore(self.bulk_workers)
+
+        async def cancel(order_id):
+            async with limit:
+                try:
+                    await self.post('/v1/user/cancel_order', json={'id': order_id})
+                except Exception as e:
+                    return _cancel_result(e)
+                return _cancel_result()
+
+        results = await asyncio.gather(*[cancel(i) for i in order_ids])
+        return dict(zip(order_ids, results))
+
+    async def cancel_all_orders(self):
+        return await self.cancel_orders(o['id'] for o in await self.orders(open=True))
+
+    async def cancel_market_orders(self, market_string=None, market_id=None):
+        _check_market_args(market_id, market_string)
+        if market_id is None:
+            market_id = (await self.markets())[market_string]['id']
+        index = _index_orders(await self.orders(open=True))
+        return await self.cancel_orders(o['id'] for o in index.get(market_id, []))
+
+    async def tickers(self):
+        """ Tickers may be indexed either by market id or market string """
+        await self._refresh_tickers()
+        return self._tickers
+
+    async def fresh_tickers(self, max_age):
+        """ Tickers no more than `max_age` seconds old, fetching them first
+        if the current snapshot is older """
+        await self._refresh_tickers(max_age)
+        return self._tickers
+
+    async def ticker_columns(self):
+        """ The tickers as a TickerColumns """
+        await self._refresh_tickers()
+        return self._columns_for(self._tickers)
+
+    async def _refresh_tickers(self, max_age=None):
+        """ Lazy load and reload every tickers_update_interval. """
+        async def load():
+            self._load_tickers(await self.get('/v1/tickers'))
+        await self._revalidate("tickers", lambda: self._tickers_freshness(max_age), load)
+
+    async def currencies(self):
+        await self._refresh_common()
+        return self._currencies_map
+
+    async def markets(self):
+        """ Markets may be indexed either by id or string """
+        await self._refresh_common()
+        return self._markets_map
+
+    async def fresh_markets(self, max_age):
+        """ Markets no more than `max_age` seconds old, fetching them first
+        if the current snapshot is older """
+        await self._refresh_common(max_age)
+        return self._markets_map
+
+    async def _refresh_common(self, max_age=None):
+        """ Lazy load and reload every market_update_interval. """
+        async def load():
+            self._load_common(await self.get("/v1/common"))
+        await self._revalidate("common", lambda: self._common_freshness(max_age), load)
+
+    async def _revalidate(self, name, freshness, load):
+        """ Await `load` if the snapshot has expired, or run it as a
+        background task if it is only stale. Concurrent callers share one
+        fetch. """
+        state = freshness()
+        if state == "fresh":
+            return
+        lock = self._get_refresh_lock(name)
+        if state == "stale":
+            # Whoever holds the lock is already fetching a new snapshot
+            if not lock.locked():
+                await lock.acquire()
+                self._refresh_tasks[name] = asyncio.ensure_future(
+                    self._background_load(lock, freshness, load))
+            return
+        async with lock:
+            if freshness() != "fresh":
+                await load()
+
+    async def _background_load(self, lock, freshness, load):
+        try:
+            if freshness() != "fresh":
+                await load()
+        except Exception:
+            log.warning("Background refresh failed", exc_info=True)
+        finally:
+            lock.release()
+
+    def _get_refresh_lock(self, name):
+        # Created lazily so the locks bind to the running loop
+        if name not in self._refresh_locks:
+            self._refresh_locks[name] = asyncio.Lock()
+        return self._refresh_locks[name]
+
+    async def _req(self, method, endpoint, silent_codes=[], headers={}, json=None, params=None, is_retry=False, timeout=None, priority=None, **kwargs):
+        with self._ratelimit_wait(method, endpoint, priority) as must_wait:
+            if must_wait > 0:
+                await asyncio.sleep(must_wait)
+        self._record_sleep(method, endpoint, priority, must_wait)
+
+        headers = dict(headers)
+        # Inject the auth token header if applicable
+        if self.token:
+            headers['Authorization'] = "Bearer {}".format(self.token)
+
+        url = urljoin(self.endpoint, endpoint)
+
+        # Support legacy usage of the json parameter, but prefer passing POST
+        # params as kwargs
+        if method.lower() == "post" and json is None:
+            json = kwargs
+        body = None
+        if json is not None:
+            body = self.codec.dumps(json)
+            headers['Content-Type'] = 'application/json'
+
+        # Support passing params just because...
+        if method.lower() == "get" and params is None:
+            params = kwargs
+        # The query string is built here rather than by aiohttp so that the
+        # signature covers exactly the URL that goes on the wire
+        if params:
+            query = urlencode([(k, v) for k, v in params.items() if v is not None])
+            if query:
+                url += "?" + query
+
+        if self.key is not None:
+            timestamp, signature = hmac_generate(self.key, url, method.upper(), body=body)
+            headers.update({
+                "Authorization": "HMAC-SHA256 {}:{}".format(self.key_id, signature),
+                "HMAC-Timestamp": timestamp
+            })
+
+        session = self._get_session()
+        request_kwargs = {}
+        if timeout is not None:
+            request_kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        started = time.time()
+        async with session.request(method.upper(), url, headers=headers, data=body, **request_kwargs) as res:
+            self._ratelimit_update(res.headers)
+            status_code = res.status
+            raw = await res.read()
+        self._trace(method, endpoint, status_code, len(raw), started)
+
+        # We've hit the rate limit, so retry. Code at beginning of call
+        # will proc now that we've populated rl_limit, etc
+        if status_code == 429 and is_retry is False:
+            if self.metrics is not None:
+                self.metrics.record_retry()
+            return await self._req(method, endpoint, silent_codes=silent_codes, headers=headers, json=json, params=params, is_retry=True, timeout=timeout, priority=priority, **kwargs)
+
+        return self._handle_response(method, endpoint, status_code, silent_codes, body,
+                                     lambda: self.codec.loads(raw),
+                                     raw)
+
+
+class AsyncPoller(Poller):
+    """ Poller for AsyncQtradeAPI, run as a task on the event loop:
+
+        poller = AsyncPoller(api)
+        poller.subscribe("/v1/user/balances", 10, on_balances)
+        task = asyncio.ensure_future(poller.run())
+    """
+
+    async def poll_once(self):
+        jobs = self._take_due(time.time())
+        results = await asyncio.gather(
+            *[self.api.get(job.endpoint, priority=self.priority, **job.params) for job in jobs],
+            return_exceptions=True)
+        for job, data in zip(jobs, results):
+            if isinstance(data, Exception):
+                log.warning("Polling %s failed", job.endpoint, exc_info=data)
+                continue
+            self._deliver(job, data, time.time())
+        return self._next_wait(time.time())
+
+    async def run(self):
+        """ Poll until stop() is called """
+        while not self._stop.is_set():
+            await asyncio.sleep(await self.poll_once())
+
+    def start(self):
+        raise TypeError("Schedule AsyncPoller.run() on the event loop instead")
+
+    def stop(self):
+        self._stop.set()
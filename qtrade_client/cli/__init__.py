@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
-import yaml
+import json
 import os
 import os.path
 import click
 import sys
 import logging
+import tempfile
 
-from pkg_resources import iter_entry_points
-from click_plugins import with_plugins
+log = logging.getLogger("qtrade-cli")
 
-from ..api import Qtrade
+PLUGIN_GROUP = 'qtrade.plugins'
 
-log = logging.getLogger("qtrade-cli")
+# Parsed config files, kept in the config dir. Hidden, so never read as one
+CACHE_FILE = ".qtctl_cache.json"
+CACHE_VERSION = 1
+# Socket of the optional `qtapi daemon`, also in the config dir
+DAEMON_SOCKET = ".qtapi.sock"
+
+# Contexts available without any config files
+BUILTIN_CONTEXTS = {
+    "dev_root": {
+        "endpoint": 'http://localhost:9898',
+        "key": '1:1111111111111111111111111111111111111111111111111111111111111111',
+        "origin": "builtin",
+    },
+}
 
 
 class bcolors:
@@ -25,8 +38,126 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
-@with_plugins(iter_entry_points('qtrade.plugins'))
-@click.group()
+def plugin_entry_points():
+    """ Entry points registered under qtrade.plugins. Only distribution
+    metadata is read; no plugin is imported. """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            from pkg_resources import iter_entry_points
+            return list(iter_entry_points(PLUGIN_GROUP))
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=PLUGIN_GROUP))
+    return list(eps.get(PLUGIN_GROUP, []))
+
+
+class PluginGroup(click.Group):
+    """ Group whose plugin subcommands are listed from entry point names and
+    imported only when one of them is invoked """
+
+    def __init__(self, *args, **kwargs):
+        super(PluginGroup, self).__init__(*args, **kwargs)
+        self._plugins = None
+
+    def _plugin_map(self):
+        if self._plugins is None:
+            self._plugins = {ep.name: ep for ep in plugin_entry_points()}
+        return self._plugins
+
+    def list_commands(self, ctx):
+        commands = super(PluginGroup, self).list_commands(ctx)
+        return sorted(set(commands) | set(self._plugin_map()))
+
+    def get_command(self, ctx, name):
+        cmd = super(PluginGroup, self).get_command(ctx, name)
+        if cmd is None and name in self._plugin_map():
+            try:
+                cmd = self._plugin_map()[name].load()
+            except Exception as e:
+                log.warning("Failed to load plugin {}: {}".format(name, e))
+                return None
+            self.add_command(cmd, name)
+        return cmd
+
+
+def parse_config(path):
+    """ {context name: QtradeAPI kwargs} from one YAML config file """
+    # Imported here so runs served from the cache never load it
+    import yaml
+    with open(path) as f:
+        cfgs = yaml.safe_load(f)
+    assert isinstance(cfgs, dict)
+    for cfg in cfgs.values():
+        assert isinstance(cfg, dict)
+    return cfgs
+
+
+def _read_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache["version"] == CACHE_VERSION:
+            return cache["files"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return {}
+
+
+def _write_cache(path, files):
+    """ Replace the cache atomically, so concurrent runs never read half of
+    it. Failing to write it only costs the next run a reparse. """
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=CACHE_FILE)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CACHE_VERSION, "files": files}, f, default=str)
+        os.replace(tmp, path)
+    except (IOError, OSError) as e:
+        log.debug("Could not write config cache {}: {}".format(path, e))
+
+
+def load_contexts(cfg_root, use_cache=True):
+    """ Read every config file in `cfg_root` without creating any clients.
+    Files unchanged in mtime and size since the last run are served from
+    the cache file instead of being parsed again. Returns ({context name:
+    QtradeAPI kwargs}, default context name). """
+    contexts = {name: dict(cfg) for name, cfg in BUILTIN_CONTEXTS.items()}
+    default_context = "dev_root"
+    if not os.path.isdir(cfg_root):
+        return contexts, default_context
+    cache_path = os.path.join(cfg_root, CACHE_FILE)
+    cached = _read_cache(cache_path) if use_cache else {}
+    files = {}
+    changed = False
+    for filename in os.scandir(cfg_root):
+        if filename.name == ".default_context":
+            with open(filename.path) as f:
+                default_context = f.read().strip()
+        if filename.name.startswith("."):  # Ignore "hidden" files
+            continue
+        st = filename.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+        entry = cached.get(filename.name)
+        if entry is None or entry.get("stamp") != stamp:
+            changed = True
+            try:
+                entry = {"stamp": stamp, "contexts": parse_config(filename.path)}
+            except Exception as e:
+                # Warned about once; the cache remembers the file is bad
+                log.warning("Failed to parse config {}: {}".format(filename.path, e))
+                entry = {"stamp": stamp, "error": str(e)}
+        files[filename.name] = entry
+        for key, cfg in entry.get("contexts", {}).items():
+            contexts[key] = dict(cfg, origin=filename.path)
+    if use_cache and (changed or len(files) != len(cached)):
+        _write_cache(cache_path, files)
+    return contexts, default_context
+
+
+@click.group(cls=PluginGroup)
 @click.option('--context', '-c')
 @click.option('--verbose', '-v', default=False, show_default=True)
 @click.option('--config-dir', '-d', default="~/.qtctl", show_default=True)
@@ -44,37 +175,29 @@ def cli(ctx, verbose, config_dir, context):
     ch.setFormatter(formatter)
     root.addHandler(ch)
 
-    contexts = {"dev_root":
-                Qtrade('http://localhost:9898',
-                       key='1:1111111111111111111111111111111111111111111111111111111111111111',
-                       origin="builtin")}
-    default_context = "dev_root"
     cfg_root = os.path.expanduser(config_dir)
-    for filename in os.scandir(cfg_root):
-        if filename.name == ".default_context":
-            default_context = open(filename.path).read().strip()
-        if filename.name.startswith("."):  # Ignore "hidden" files
-            continue
+    contexts, default_context = load_contexts(cfg_root)
+    # If they explicity specified a context, use that, else the default
+    if context is None:
+        context = default_context
+
+    # Only the selected context gets a client. The api module pulls in
+    # requests, so --help and plugin listing don't import it. Requests go
+    # through the daemon when one is running
+    cfg = contexts.get(context)
+    active_context = None
+    if cfg is not None:
+        from ..daemon import DaemonQtradeAPI
         try:
-            cfgs = yaml.load(open(filename.path))
-            assert isinstance(cfgs, dict)
-            for key, cfg in cfgs.items():
-                contexts[key] = Qtrade(origin=filename.path, **cfg)
+            active_context = DaemonQtradeAPI(
+                context=context, socket_path=os.path.join(cfg_root, DAEMON_SOCKET), **cfg)
         except Exception as e:
-            log.warn("Failed to parse config {}: {}".format(filename, e))
-            continue
-
-    # Default to our context if it exists
-    active_context = contexts.get(default_context)
-    # If they explicity specified a context, use that if it exists
-    if context is not None:
-        active_context = contexts.get(context)
-    else:
-        context = default_context
+            log.fatal("Invalid context {} from {}: {}".format(context, cfg.get('origin'), e))
+            sys.exit(1)
 
     if active_context is None:
         log.fatal("Failed to set context to {}: only have {}"
-                  .format(context, contexts.keys()))
+                  .format(context, sorted(contexts.keys())))
         sys.exit(1)
 
     print("using profile '{}' from '{}' => {} @ {}"
@@ -84,6 +207,16 @@ def cli(ctx, verbose, config_dir, context):
                   bcolors.OKBLUE + active_context.endpoint + bcolors.ENDC,
                   ))
     ctx.obj['client'] = active_context
+    ctx.obj['config_dir'] = cfg_root
+
+
+@cli.command()
+@click.pass_context
+def daemon(ctx):
+    """ Keep warm clients for every context in the background, so later
+    qtapi runs reuse their connections, caches and rate limit state """
+    from ..daemon import serve
+    serve(os.path.join(ctx.obj['config_dir'], DAEMON_SOCKET))
 
 
 def entry():
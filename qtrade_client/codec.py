@@ -0,0 +1,53 @@
+import json as _json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec(object):
+    """ Encodes request bodies to utf8 bytes and decodes response bodies,
+    using the stdlib json module """
+    name = "json"
+
+    def dumps(self, obj):
+        return _json.dumps(obj).encode('utf8')
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf8')
+        return _json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    name = "ujson"
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf8')
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+def default_codec():
+    """ The fastest codec available: orjson, then ujson, then the stdlib """
+    if orjson is not None:
+        return OrjsonCodec()
+    if ujson is not None:
+        return UjsonCodec()
+    return JSONCodec()
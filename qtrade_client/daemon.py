@@ -0,0 +1,256 @@
+""" Optional local daemon that keeps warm QtradeAPI clients between short
+lived processes such as qtapi runs. Clients live in the daemon, one per
+context, with their keep-alive sessions, rate limiter and market data
+caches, and DaemonQtradeAPI forwards requests to them over a Unix socket.
+
+    qtapi daemon              # or: python -m qtrade_client.daemon
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import requests
+
+from .api import APIException, QtradeAPI
+
+log = logging.getLogger("qtrade")
+
+DEFAULT_SOCKET = "~/.qtctl/.qtapi.sock"
+
+
+class DaemonUnavailable(Exception):
+    """ The daemon could not be reached """
+
+
+class DaemonError(Exception):
+    """ A forwarded request failed in the daemon other than with an
+    APIException, e.g. on a network error """
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves newline-delimited JSON requests on a Unix socket. Each
+    request names a context and carries its QtradeAPI arguments, and runs
+    on a client kept for that context. """
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        path = os.path.expanduser(path)
+        if os.path.exists(path):
+            if _reachable(path):
+                raise RuntimeError("A daemon is already listening on {}".format(path))
+            # Left behind by a daemon that didn't shut down cleanly
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        # The socket carries API keys, so keep it private to this user
+        os.chmod(path, 0o600)
+        self.path = path
+        self.clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, context, config):
+        """ The warm client for a context, created on first use and replaced
+        if the context's config changes """
+        key = (context, json.dumps(config, sort_keys=True))
+        with self._lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = QtradeAPI(**config)
+                # Serve market data from the daemon's cache for as long as
+                # the client itself would keep it
+                client.get_cache_ttl = {
+                    "/v1/common": client.market_update_interval,
+                    "/v1/tickers": client.tickers_update_interval,
+                }
+                self.clients[key] = client
+                log.info("Daemon created client for context %s", context)
+        return client
+
+    def handle(self, req):
+        client = self.client(req["context"], req["config"])
+        method, endpoint = req["method"], req["endpoint"]
+        silent_codes = req.get("silent_codes", [])
+        try:
+            if method.lower() == 'get' and endpoint in client.get_cache_ttl:
+                # Cached market data goes back with its age, so the caller
+                # doesn't take it for just fetched
+                data, fetched_at = client._coalesced_get(
+                    endpoint, silent_codes, req["kwargs"], max_age=req.get("max_age"))
+                return {"data": data, "age": max(0, time.time() - fetched_at)}
+            data = client._req(method, endpoint, silent_codes=silent_codes, **req["kwargs"])
+        except APIException as e:
+            return {"error": {"message": e.args[0], "code": e.code, "errors": e.errors}}
+        except Exception as e:
+            return {"error": {"message": "{}: {}".format(type(e).__name__, e), "api": False}}
+        return {"data": data}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                res = self.server.handle(json.loads(line.decode('utf8')))
+            except Exception as e:
+                res = {"error": {"message": "Bad daemon request: {}".format(e), "api": False}}
+            self.wfile.write(json.dumps(res).encode('utf8') + b"\n")
+            self.wfile.flush()
+
+
+def _reachable(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        s.close()
+
+
+def serve(path=DEFAULT_SOCKET):
+    """ Run a daemon until interrupted """
+    server = DaemonServer(path)
+    log.info("qtapi daemon listening on %s", server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class DaemonQtradeAPI(QtradeAPI):
+    """ QtradeAPI that sends requests through a running daemon, so they
+    reuse its warm connections, caches and rate limit state. Falls back to
+    making requests itself when no daemon is running. """
+
+    def __init__(self, endpoint, context="default", socket_path=DEFAULT_SOCKET, **kwargs):
+        super(DaemonQtradeAPI, self).__init__(endpoint, **kwargs)
+        self.context = context
+        self.socket_path = os.path.expanduser(socket_path)
+        # What the daemon needs to build the same client
+        self.config = dict(kwargs, endpoint=endpoint)
+        self.config.pop('limiter', None)
+        self._sock = None
+        self._rfile = None
+        self._daemon_down = False
+        self._sock_lock = threading.Lock()
+        # Oldest market data this thread's refresh will accept
+        self._local = threading.local()
+        # {endpoint: (data, fetched_at)} of the last cached reply
+        self._fetched = {}
+
+    def _req(self, method, endpoint, silent_codes=[], **kwargs):
+        if not self._daemon_down and not kwargs.get('stream'):
+            try:
+                return self._forward(method, endpoint, silent_codes, kwargs)
+            except DaemonUnavailable as e:
+                log.debug("Not using daemon: %s", e)
+        return super(DaemonQtradeAPI, self)._req(method, endpoint, silent_codes=silent_codes, **kwargs)
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+            except (IOError, OSError) as e:
+                sock.close()
+                self._daemon_down = True
+                raise DaemonUnavailable(e)
+            self._sock = sock
+            self._rfile = sock.makefile('rb')
+        return self._sock
+
+    def _forward(self, method, endpoint, silent_codes, kwargs):
+        try:
+            line = json.dumps({
+                "context": self.context, "config": self.config, "method": method,
+                "endpoint": endpoint, "silent_codes": list(silent_codes), "kwargs": kwargs,
+                "max_age": getattr(self._local, 'max_age', None),
+            }).encode('utf8') + b"\n"
+        except (TypeError, ValueError) as e:
+            raise DaemonUnavailable("request can't be forwarded: {}".format(e))
+        with self._sock_lock:
+            sock = self._connect()
+            try:
+                sock.sendall(line)
+                raw = self._rfile.readline()
+            except (IOError, OSError):
+                raw = b""
+            if not raw:
+                self.close_daemon()
+                if method.lower() != 'get':
+                    # The daemon may have sent it already; don't risk a repeat
+                    raise requests.exceptions.ConnectionError(
+                        "Lost the daemon connection during {} {}".format(method, endpoint))
+                raise DaemonUnavailable("connection lost")
+        res = json.loads(raw.decode('utf8'))
+        if "error" in res:
+            err = res["error"]
+            if err.get("api") is False:
+                raise DaemonError(err["message"])
+            raise APIException(err["message"], err["code"], err["errors"])
+        if "age" in res:
+            self._fetched[endpoint] = (res["data"], time.time() - res["age"])
+        return res["data"]
+
+    @contextmanager
+    def _max_age(self, max_age):
+        """ Have the daemon serve market data no older than `max_age` to
+        requests made on this thread meanwhile """
+        previous = getattr(self._local, 'max_age', None)
+        self._local.max_age = max_age
+        try:
+            yield
+        finally:
+            self._local.max_age = previous
+
+    def _refresh_tickers(self, max_age=None):
+        with self._max_age(max_age if max_age is not None else self.tickers_update_interval):
+            super(DaemonQtradeAPI, self)._refresh_tickers(max_age)
+
+    def _refresh_common(self, max_age=None):
+        with self._max_age(max_age if max_age is not None else self.market_update_interval):
+            super(DaemonQtradeAPI, self)._refresh_common(max_age)
+
+    def _fetched_at(self, endpoint, data):
+        """ When the daemon fetched `data`, if it came from its cache """
+        entry = self._fetched.get(endpoint)
+        if entry is not None and entry[0] is data:
+            return entry[1]
+        return None
+
+    def _load_tickers(self, res, fetched_at=None):
+        super(DaemonQtradeAPI, self)._load_tickers(
+            res, fetched_at or self._fetched_at('/v1/tickers', res))
+
+    def _load_common(self, common, fetched_at=None):
+        super(DaemonQtradeAPI, self)._load_common(
+            common, fetched_at or self._fetched_at('/v1/common', common))
+
+    def close_daemon(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = self._rfile = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
@@ -0,0 +1,169 @@
+import calendar
+import json as _json
+import logging
+import os
+from array import array
+from datetime import datetime
+
+from .api import to_satoshi
+from .orders import iter_order_pages
+
+log = logging.getLogger("qtrade")
+
+# 64 bit signed integers. Python 2's array has no 'q', but 'l' is 64 bit on
+# the LP64 platforms we run on
+INT64 = 'q' if 'q' in getattr(array, 'typecodes', '') else 'l'
+
+SIDES = {"buy": 0, "sell": 1}
+
+# Amounts and prices are satoshis, times are microseconds since the epoch
+ORDER_COLUMNS = ("id", "market_id", "side", "created_at", "price",
+                 "market_amount", "market_amount_remaining", "base_amount")
+TRADE_COLUMNS = ("id", "order_id", "market_id", "side", "created_at", "price",
+                 "market_amount", "base_amount", "base_fee", "taker")
+
+
+def parse_time(stamp):
+    """ API timestamp such as "2019-11-14T16:34:20.424601Z" to epoch
+    microseconds """
+    fmt = "%Y-%m-%dT%H:%M:%S.%fZ" if "." in stamp else "%Y-%m-%dT%H:%M:%SZ"
+    dt = datetime.strptime(stamp, fmt)
+    return calendar.timegm(dt.timetuple()) * 1000000 + dt.microsecond
+
+
+def _sat(value):
+    return 0 if value is None else to_satoshi(value)
+
+
+class _Table(object):
+    """ Append-only int64 columns, one file per column """
+
+    def __init__(self, path, name, columns):
+        self.columns = columns
+        self._paths = {c: os.path.join(path, "{}.{}.i64".format(name, c)) for c in columns}
+        self.data = {}
+        for c in columns:
+            col = array(INT64)
+            if os.path.exists(self._paths[c]):
+                with open(self._paths[c], "rb") as f:
+                    col.fromfile(f, os.path.getsize(self._paths[c]) // col.itemsize)
+            self.data[c] = col
+        # Columns may disagree in length after a crash mid-append
+        rows = min(len(col) for col in self.data.values())
+        for c in columns:
+            del self.data[c][rows:]
+
+    def __len__(self):
+        return len(self.data[self.columns[0]])
+
+    def append(self, rows):
+        if not rows:
+            return
+        stored = len(self)
+        for i, c in enumerate(self.columns):
+            col = array(INT64, [r[i] for r in rows])
+            with open(self._paths[c], "ab") as f:
+                # Truncate any partial append left by a crash
+                f.truncate(stored * col.itemsize)
+                col.tofile(f)
+            self.data[c].extend(col)
+
+    def where(self, market_id=None, start=None, end=None):
+        """ Columns of the rows on `market_id` created in [start, end) """
+        markets = self.data["market_id"]
+        times = self.data["created_at"]
+        rows = [i for i in range(len(self))
+                if (market_id is None or markets[i] == market_id)
+                and (start is None or times[i] >= start)
+                and (end is None or times[i] < end)]
+        return {c: array(INT64, [self.data[c][i] for i in rows]) for c in self.columns}
+
+
+class OrderHistory(object):
+    """ On-disk history of closed orders and their trades. The first sync
+    backfills the whole history; later ones fetch only orders newer than the
+    watermark. Orders still open are tracked by id and stored once they
+    close. Stored as int64 column files under `path`, so years of
+    history load with a few reads and can be filtered without touching
+    JSON. Columns are array.array objects; numpy users can wrap them with
+    numpy.frombuffer without copying. """
+
+    def __init__(self, path, api=None):
+        self.path = path
+        self.api = api
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.orders = _Table(path, "orders", ORDER_COLUMNS)
+        self.trades = _Table(path, "trades", TRADE_COLUMNS)
+        self._ids = set(self.orders.data["id"])
+        self._trade_ids = set(self.trades.data["id"])
+        self._meta_path = os.path.join(path, "meta.json")
+        self.watermark = None
+        # Ids of orders seen open, stored once they close
+        self.open_ids = set()
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = _json.load(f)
+            self.watermark = meta["watermark"]
+            self.open_ids = set(meta.get("open", []))
+
+    def sync(self):
+        """ Fetch orders newer than the watermark, or all of them on the
+        first sync, plus any tracked open orders that have since closed, and
+        append the closed ones. Returns the number of orders appended. """
+        fetched = []
+        for page in iter_order_pages(self.api, down_to=self.watermark):
+            fetched.extend(page)
+        closed = [o for o in fetched if not o['open']]
+        open_ids = set(o['id'] for o in fetched if o['open'])
+        if self.open_ids:
+            # One open=true request tells which tracked orders closed
+            still_open = set(o['id'] for o in self.api.orders(open=True))
+            for order_id in self.open_ids - still_open:
+                order = self.api.get("/v1/user/order/{}".format(order_id))['order']
+                if order['open']:
+                    open_ids.add(order_id)
+                else:
+                    closed.append(order)
+            open_ids.update(self.open_ids & still_open)
+        appended = self.append(closed)
+        watermark = max([o['id'] for o in fetched] or [self.watermark])
+        if watermark != self.watermark or open_ids != self.open_ids:
+            self._save_meta(watermark, open_ids)
+        return appended
+
+    def append(self, orders):
+        """ Append closed order dicts not already stored. Returns the number
+        appended. """
+        order_rows = []
+        trade_rows = []
+        for o in sorted(orders, key=lambda o: o['id']):
+            if o['id'] in self._ids:
+                continue
+            self._ids.add(o['id'])
+            side = SIDES[o['order_type'].split('_')[0]]
+            order_rows.append((
+                o['id'], o['market_id'], side, parse_time(o['created_at']),
+                _sat(o['price']), _sat(o['market_amount']),
+                _sat(o.get('market_amount_remaining')), _sat(o.get('base_amount'))))
+            for t in o.get('trades') or []:
+                # Trades are written first, so a crash before the orders
+                # are can leave them stored already
+                if t['id'] in self._trade_ids:
+                    continue
+                self._trade_ids.add(t['id'])
+                trade_rows.append((
+                    t['id'], o['id'], o['market_id'], side, parse_time(t['created_at']),
+                    _sat(t['price']), _sat(t['market_amount']), _sat(t.get('base_amount')),
+                    _sat(t.get('base_fee')), int(bool(t.get('taker')))))
+        self.trades.append(trade_rows)
+        self.orders.append(order_rows)
+        return len(order_rows)
+
+    def _save_meta(self, watermark, open_ids):
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            _json.dump({"watermark": watermark, "open": sorted(open_ids)}, f)
+        os.rename(tmp, self._meta_path)
+        self.watermark = watermark
+        self.open_ids = open_ids
@@ -0,0 +1,195 @@
+import re
+import threading
+
+# Upper bounds, in seconds, of the buckets exported to Prometheus
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                      0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram(object):
+    """ Log-linear histogram of durations in the style of HdrHistogram.
+    Values are bucketed in microseconds with 2**sub_bits buckets per power
+    of two, so recording is O(1) and quantiles are within 2**(1-sub_bits)
+    (under 2% by default) of the true value. Not thread-safe by itself. """
+
+    def __init__(self, sub_bits=7):
+        self.sub_bits = sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, micros):
+        if micros < 2 * self._half:
+            return micros
+        exp = micros.bit_length() - self.sub_bits
+        return exp * self._half + (micros >> exp)
+
+    def _bounds(self, index):
+        """ [low, high) microsecond range of a bucket """
+        if index < 2 * self._half:
+            return index, index + 1
+        exp = index // self._half - 1
+        mantissa = index - exp * self._half
+        return mantissa << exp, (mantissa + 1) << exp
+
+    def record(self, seconds):
+        micros = max(0, int(seconds * 1000000))
+        index = self._index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """ Upper bound in seconds of the bucket holding quantile q """
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._bounds(index)[1] / 1000000.0, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """ Counts of values <= each bound in seconds, for Prometheus. A
+        bucket straddling a bound counts toward the next one. """
+        items = sorted((self._bounds(i)[1] / 1000000.0, c) for i, c in self.counts.items())
+        out = []
+        seen = 0
+        pos = 0
+        for bound in bounds:
+            while pos < len(items) and items[pos][0] <= bound:
+                seen += items[pos][1]
+                pos += 1
+            out.append(seen)
+        return out
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "p999": self.quantile(0.999),
+        }
+
+
+def endpoint_label(endpoint):
+    """ Collapse ids in a path (/v1/user/order/123) so each endpoint gets
+    one series """
+    return _ID_SEGMENT.sub("/:id", endpoint.split("?", 1)[0])
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def _labels(**labels):
+    return ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in sorted(labels.items()))
+
+
+def lane_prometheus_lines(lanes):
+    """ Prometheus text lines for RequestScheduler.stats() """
+    lines = ["# TYPE qtrade_lane_queued gauge"]
+    for lane, stats in sorted(lanes.items()):
+        lines.append("qtrade_lane_queued{{{}}} {}".format(_labels(lane=lane), stats["queued"]))
+    lines.append("# TYPE qtrade_lane_wait_seconds_total counter")
+    for lane, stats in sorted(lanes.items()):
+        for reason in ("hard", "soft", "reserve"):
+            lines.append("qtrade_lane_wait_seconds_total{{{}}} {}".format(
+                _labels(lane=lane, reason=reason), stats[reason + "_wait_time"]))
+    return lines
+
+
+class Metrics(object):
+    """ Request telemetry for a client: latency and JSON decode time per
+    endpoint, rate limit sleeps per lane, 429 retries and APIException
+    codes. Assign one to `client.metrics` to start recording. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.decode = {}
+        self.sleep = {}
+        self.retries_429 = 0
+        self.errors = {}
+
+    def _observe(self, table, key, seconds):
+        with self._lock:
+            hist = table.get(key)
+            if hist is None:
+                hist = table[key] = Histogram()
+            hist.record(seconds)
+
+    def record_request(self, method, endpoint, seconds):
+        self._observe(self.latency, (method, endpoint_label(endpoint)), seconds)
+
+    def record_decode(self, endpoint, seconds):
+        self._observe(self.decode, endpoint_label(endpoint), seconds)
+
+    def record_sleep(self, lane, seconds):
+        self._observe(self.sleep, lane, seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries_429 += 1
+
+    def record_error(self, status, codes):
+        with self._lock:
+            for code in codes or [None]:
+                key = (status, code)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def snapshot(self, lanes=None):
+        """ Plain dict of everything recorded. `lanes` is
+        RequestScheduler.stats(), included as is. """
+        with self._lock:
+            snap = {
+                "latency": {"{} {}".format(*k): h.snapshot() for k, h in self.latency.items()},
+                "decode": {k: h.snapshot() for k, h in self.decode.items()},
+                "sleep": {k: h.snapshot() for k, h in self.sleep.items()},
+                "retries_429": self.retries_429,
+                "errors": [{"status": s, "code": c, "count": n}
+                           for (s, c), n in sorted(self.errors.items(), key=str)],
+            }
+        if lanes is not None:
+            snap["lanes"] = lanes
+        return snap
+
+    def prometheus(self, lanes=None):
+        """ Prometheus text exposition format """
+        lines = []
+        with self._lock:
+            for name, helptext, table, label_names in (
+                    ("qtrade_request_seconds", "Request latency", self.latency, ("method", "endpoint")),
+                    ("qtrade_decode_seconds", "JSON decode time", self.decode, ("endpoint",)),
+                    ("qtrade_ratelimit_sleep_seconds", "Time slept for the rate limit", self.sleep, ("lane",))):
+                lines.append("# HELP {} {}".format(name, helptext))
+                lines.append("# TYPE {} histogram".format(name))
+                for key, hist in sorted(table.items(), key=str):
+                    labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+                    for bound, count in zip(PROMETHEUS_BUCKETS, hist.cumulative(PROMETHEUS_BUCKETS)):
+                        lines.append("{}_bucket{{{}}} {}".format(name, _labels(le=bound, **labels), count))
+                    lines.append("{}_bucket{{{}}} {}".format(name, _labels(le="+Inf", **labels), hist.count))
+                    lines.append("{}_sum{{{}}} {}".format(name, _labels(**labels), hist.sum))
+                    lines.append("{}_count{{{}}} {}".format(name, _labels(**labels), hist.count))
+            lines.append("# TYPE qtrade_ratelimit_retries_total counter")
+            lines.append("qtrade_ratelimit_retries_total {}".format(self.retries_429))
+            lines.append("# TYPE qtrade_api_errors_total counter")
+            for (status, code), n in sorted(self.errors.items(), key=str):
+                lines.append("qtrade_api_errors_total{{{}}} {}".format(
+                    _labels(status=status, code=code or ""), n))
+        if lanes is not None:
+            lines.extend(lane_prometheus_lines(lanes))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,169 @@
+import logging
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from .api import _div_round, from_satoshi, to_satoshi
+
+log = logging.getLogger("qtrade")
+
+
+class _BookSide(object):
+    """ Price levels of one side of a book in integer satoshis. Levels are
+    kept sorted best first: asks by price, bids by negated price, so both
+    sides share the same bisect logic. Running totals from the best level
+    down are rebuilt on the first query after a change. """
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = []
+        self.amounts = {}
+        self._cum_amount = None
+        self._cum_notional = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set(self, price, amount):
+        """ Set the amount at a price level, removing it when amount is 0 """
+        key = self.sign * price
+        if amount:
+            if price not in self.amounts:
+                insort(self.keys, key)
+            elif self.amounts[price] == amount:
+                return
+            self.amounts[price] = amount
+        elif price in self.amounts:
+            del self.amounts[price]
+            del self.keys[bisect_left(self.keys, key)]
+        else:
+            return
+        self._cum_amount = None
+
+    def replace(self, levels):
+        """ Apply the difference between the current levels and `levels`, a
+        {price: amount} dict. Returns the number of levels changed. """
+        changed = 0
+        for price in [p for p in self.amounts if p not in levels]:
+            self.set(price, 0)
+            changed += 1
+        for price, amount in levels.items():
+            if self.amounts.get(price) != amount:
+                self.set(price, amount)
+                changed += 1
+        return changed
+
+    def best(self):
+        return self.sign * self.keys[0] if self.keys else None
+
+    def _totals(self):
+        if self._cum_amount is None:
+            cum_amount = []
+            cum_notional = []
+            amount = notional = 0
+            for key in self.keys:
+                price = self.sign * key
+                amount += self.amounts[price]
+                notional += self.amounts[price] * price
+                cum_amount.append(amount)
+                cum_notional.append(notional)
+            self._cum_amount, self._cum_notional = cum_amount, cum_notional
+        return self._cum_amount, self._cum_notional
+
+    def depth(self, price):
+        """ Total amount at `price` or better """
+        cum_amount, _ = self._totals()
+        n = bisect_right(self.keys, self.sign * price)
+        return cum_amount[n - 1] if n else 0
+
+    def cost(self, amount):
+        """ Notional value, in satoshis times satoshis, of taking `amount`
+        from the best level down. None if the side is too shallow. """
+        cum_amount, cum_notional = self._totals()
+        i = bisect_left(cum_amount, amount)
+        if i == len(cum_amount):
+            return None
+        filled = cum_amount[i - 1] if i else 0
+        notional = cum_notional[i - 1] if i else 0
+        return notional + (amount - filled) * self.sign * self.keys[i]
+
+
+class OrderBook(object):
+    """ Local copy of one market's order book from /v1/orderbook. Each
+    `refresh` applies only the levels that changed. Best bid and ask are
+    O(1), and depth and VWAP queries are O(log n) in the number of levels.
+    Prices and amounts are Decimal, kept as integer satoshis inside. """
+
+    def __init__(self, api, market_string):
+        self.api = api
+        self.market_string = market_string
+        self.endpoint = "/v1/orderbook/{}".format(market_string)
+        self.sides = {"buy": _BookSide(-1), "sell": _BookSide(1)}
+        self.last_change = None
+        self.updated_at = 0
+
+    @property
+    def age(self):
+        """ Seconds since the book was last refreshed """
+        return time.time() - self.updated_at
+
+    def refresh(self):
+        """ Fetch the book and apply what changed. Returns the number of
+        levels changed. """
+        return self.load(self.api.get(self.endpoint))
+
+    def load(self, data):
+        """ Apply a /v1/orderbook response, e.g. one fetched with
+        AsyncQtradeAPI. Returns the number of levels changed. """
+        self.updated_at = time.time()
+        if self.last_change is not None and data.get('last_change') == self.last_change:
+            return 0
+        changed = 0
+        for name, side in self.sides.items():
+            levels = {to_satoshi(p): to_satoshi(a) for p, a in data.get(name, {}).items()}
+            changed += side.replace(levels)
+        self.last_change = data.get('last_change')
+        log.debug("%s book refreshed, %s levels changed", self.market_string, changed)
+        return changed
+
+    def _in(self, value):
+        return to_satoshi(value)
+
+    def _out(self, value):
+        if value is None:
+            return value
+        return from_satoshi(value)
+
+    def best_bid(self):
+        return self._out(self.sides["buy"].best())
+
+    def best_ask(self):
+        return self._out(self.sides["sell"].best())
+
+    def amount_at(self, side, price):
+        """ Amount resting at exactly `price` on `side` ("buy" or "sell") """
+        return self._out(self.sides[side].amounts.get(self._in(price), 0))
+
+    def depth(self, side, price):
+        """ Total amount on `side` at `price` or better, i.e. what an order
+        against that side limited to `price` could fill """
+        return self._out(self.sides[side].depth(self._in(price)))
+
+    def vwap(self, side, amount):
+        """ Average price of taking `amount` from `side`, or None if the book
+        is not deep enough """
+        amount = self._in(amount)
+        notional = self.sides[side].cost(amount)
+        if notional is None or not amount:
+            return None
+        return self._out(_div_round(notional, amount))
+
+    def would_take(self, order_type, price):
+        """ Whether a limit order at `price` would cross the book """
+        price = self._in(price)
+        if order_type == "buy_limit":
+            ask = self.sides["sell"].best()
+            return ask is not None and price >= ask
+        if order_type == "sell_limit":
+            bid = self.sides["buy"].best()
+            return bid is not None and price <= bid
+        return False
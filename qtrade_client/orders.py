@@ -0,0 +1,119 @@
+import logging
+
+log = logging.getLogger("qtrade")
+
+
+def order_side(order):
+    """ "buy" or "sell" for an order dict """
+    return order['order_type'].split('_')[0]
+
+
+def iter_order_pages(api, older_than=None, down_to=None):
+    """ Pages of /v1/user/orders, which come newest first, walking back
+    with older_than from `older_than` (or the newest order) until history
+    runs out. With `down_to`, only orders newer than that id are asked for,
+    so when nothing has changed the walk is one empty page. """
+    while True:
+        page = api.orders(older_than=older_than, newer_than=down_to)
+        if not page:
+            return
+        oldest = min(o['id'] for o in page)
+        if down_to is not None and oldest <= down_to:
+            # The backend ignored newer_than
+            page = [o for o in page if o['id'] > down_to]
+            if page:
+                yield page
+            return
+        yield page
+        if older_than is not None and oldest >= older_than:
+            # The backend ignored older_than; don't loop forever
+            return
+        older_than = oldest
+
+
+class OrderStore(object):
+    """ Local copy of an account's orders. Call `backfill` once to page
+    through the full history, then `sync` each cycle to fetch only orders
+    newer than the newest one held. Open orders are indexed by id, market and
+    side.
+
+    New orders only ever show up through `sync`. Fills and cancels of orders
+    already held are picked up by `refresh_open`. """
+
+    def __init__(self, api):
+        self.api = api
+        self.orders = {}
+        self.open = {}
+        self._by_market = {}
+        self._by_side = {"buy": set(), "sell": set()}
+        self.max_id = None
+        self.min_id = None
+
+    def backfill(self):
+        """ Page backwards from the oldest order held until history runs out.
+        Returns the number of orders added. """
+        added = 0
+        for page in iter_order_pages(self.api, older_than=self.min_id):
+            self.update(page)
+            added += len(page)
+        log.debug("Backfilled %s orders", added)
+        return added
+
+    def sync(self):
+        """ Fetch orders newer than the newest held, paging back from the
+        newest order with newer_than set to it. Backfills if nothing is held
+        yet. Returns the list of new orders. """
+        if self.max_id is None:
+            self.backfill()
+            return list(self.orders.values())
+        new = []
+        for page in iter_order_pages(self.api, down_to=self.max_id):
+            new.extend(page)
+        # Merged only once every page is in, so a failed page can't leave
+        # max_id above orders never fetched
+        self.update(new)
+        return new
+
+    def refresh_open(self):
+        """ Replace the open set from one open=True request. Orders that are
+        no longer open are kept in history as closed. """
+        current = self.api.orders(open=True)
+        current_ids = set(o['id'] for o in current)
+        for order_id in list(self.open):
+            if order_id not in current_ids:
+                self.orders[order_id]['open'] = False
+                self._unindex(self.orders[order_id])
+        self.update(current)
+
+    def update(self, orders):
+        """ Merge order dicts from the API into the store """
+        for o in orders:
+            old = self.orders.get(o['id'])
+            if old is not None:
+                self._unindex(old)
+            self.orders[o['id']] = o
+            if o['open']:
+                self.open[o['id']] = o
+                self._by_market.setdefault(o['market_id'], set()).add(o['id'])
+                self._by_side[order_side(o)].add(o['id'])
+            if self.max_id is None or o['id'] > self.max_id:
+                self.max_id = o['id']
+            if self.min_id is None or o['id'] < self.min_id:
+                self.min_id = o['id']
+
+    def _unindex(self, order):
+        self.open.pop(order['id'], None)
+        self._by_market.get(order['market_id'], set()).discard(order['id'])
+        self._by_side[order_side(order)].discard(order['id'])
+
+    def open_orders(self, market_id=None, side=None):
+        """ Open orders, optionally limited to one market and/or side """
+        ids = None
+        if market_id is not None:
+            ids = self._by_market.get(market_id, set())
+        if side is not None:
+            side_ids = self._by_side[side]
+            ids = side_ids if ids is None else ids & side_ids
+        if ids is None:
+            return list(self.open.values())
+        return [self.open[i] for i in ids]
@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger("qtrade")
+
+
+class Subscription(object):
+    """ One subscriber to a polled endpoint. `select` picks the part of the
+    response it cares about; it is only called back when that part
+    changes. """
+    __slots__ = ('key', 'interval', 'callback', 'select', 'last', 'due')
+
+    def __init__(self, key, interval, callback, select):
+        self.key = key
+        self.interval = interval
+        self.callback = callback
+        self.select = select
+        self.last = _UNSET
+        self.due = 0
+
+
+_UNSET = object()
+
+
+class _Job(object):
+    """ A (endpoint, params) pair polled once for all its subscribers """
+    __slots__ = ('key', 'endpoint', 'params', 'subscribers', 'generation')
+
+    def __init__(self, key, endpoint, params):
+        self.key = key
+        self.endpoint = endpoint
+        self.params = params
+        self.subscribers = []
+        self.generation = 0
+
+    @property
+    def interval(self):
+        return min(s.interval for s in self.subscribers)
+
+
+class Poller(object):
+    """ Polls many endpoints from one thread on a single schedule. Every
+    subscription to the same endpoint and params shares one request, made
+    as often as its most frequent subscriber asks. Requests go through the
+    client, so they are paced by its rate limiter in the priority lane
+    `priority` (market data by default for public endpoints).
+
+        poller = Poller(api)
+        poller.subscribe("/v1/tickers", 5, on_ltc,
+                         select=lambda d: d["markets"][0]["last"])
+        poller.start()
+    """
+
+    # Longest sleep with nothing scheduled
+    idle_wait = 1.0
+
+    def __init__(self, api, priority=None):
+        self.api = api
+        self.priority = priority
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+
+    def subscribe(self, endpoint, interval, callback, select=None, **params):
+        """ Call `callback(data)` with the response data of GET `endpoint`,
+        at most every `interval` seconds and only when it (or
+        `select(data)`) changed since the last call """
+        key = (endpoint, tuple(sorted(params.items())))
+        sub = Subscription(key, interval, callback, select)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = _Job(key, endpoint, params)
+            job.subscribers.append(sub)
+            self._schedule(job, time.time())
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            job = self._jobs.get(sub.key)
+            if job is None or sub not in job.subscribers:
+                return
+            job.subscribers.remove(sub)
+            if not job.subscribers:
+                del self._jobs[sub.key]
+
+    def _schedule(self, job, due):
+        # Superseded heap entries are skipped when popped
+        job.generation += 1
+        heapq.heappush(self._heap, (due, next(self._seq), job.generation, job))
+
+    def _take_due(self, now):
+        """ Pop the jobs due by `now` and schedule their next run """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                at, _, generation, job = heapq.heappop(self._heap)
+                if generation != job.generation or self._jobs.get(job.key) is not job:
+                    continue
+                due.append(job)
+                # A late job runs once, not once per missed interval
+                self._schedule(job, max(at + job.interval, now))
+        return due
+
+    def _next_wait(self, now):
+        """ Seconds until the next job is due, capped at idle_wait """
+        with self._lock:
+            wait = self._heap[0][0] - now if self._heap else self.idle_wait
+        return max(0, min(wait, self.idle_wait))
+
+    def _deliver(self, job, data, now):
+        """ Pass data to each subscriber whose interval is up and whose view
+        of it changed """
+        subscribers = list(job.subscribers)
+        if not subscribers:
+            return
+        # Subscribers polling less often than the job are served by the run
+        # nearest their due time
+        slack = min(s.interval for s in subscribers) / 2.0
+        for sub in subscribers:
+            if sub.due - now > slack:
+                continue
+            sub.due = now + sub.interval
+            try:
+                view = data if sub.select is None else sub.select(data)
+                if view == sub.last:
+                    continue
+                sub.last = view
+                sub.callback(view)
+            except Exception:
+                log.warning("Poll subscriber for %s failed", job.endpoint, exc_info=True)
+
+    def poll_once(self):
+        """ Run every job that is due. Returns the seconds until the next
+        one. """
+        for job in self._take_due(time.time()):
+            try:
+                data = self.api.get(job.endpoint, priority=self.priority, **job.params)
+            except Exception:
+                log.warning("Polling %s failed", job.endpoint, exc_info=True)
+                continue
+            self._deliver(job, data, time.time())
+        return self._next_wait(time.time())
+
+    def run(self):
+        """ Poll until stop() is called """
+        while not self._stop.is_set():
+            wait = self.poll_once()
+            if wait:
+                self._wake.wait(wait)
+                self._wake.clear()
+
+    def start(self):
+        """ Run the poller on a daemon thread """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="qtrade-poller")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,221 @@
+import json as _json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger("qtrade")
+
+# Request priority lanes, most urgent first
+PRIORITY_TRADE = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+LANES = ("trade", "account", "market")
+
+
+def request_priority(method, endpoint):
+    """ Default lane for a request: placing and cancelling orders, then
+    account reads, then public market data """
+    if endpoint.startswith("/v1/user/"):
+        if method.lower() == "post":
+            return PRIORITY_TRADE
+        return PRIORITY_ACCOUNT
+    return PRIORITY_MARKET
+
+
+class RateLimiter(object):
+    """ Thread-safe token bucket tracking one API key's request budget. Share
+    a single instance between clients (and threads) using the same key so
+    they pace the quota together.
+
+    The bucket holds `remaining` of `limit` tokens until `reset_at`, when it
+    refills. It is resynced from the X-Ratelimit-* headers of every
+    response. """
+
+    def __init__(self, limit=120, remaining=99, reset_at=None, soft_threshold=0.5):
+        self._lock = threading.Lock()
+        self._state = {
+            "limit": limit,
+            "remaining": remaining,
+            "reset_at": time.time() if reset_at is None else reset_at,
+            # Requests drawing on the next window must not go before this
+            "not_before": 0,
+        }
+        # Set to 1 to disable soft threshold, 0 will always sleep between calls
+        # if needed (no burst at all)
+        self.soft_threshold = soft_threshold
+
+    @contextmanager
+    def _locked(self):
+        """ Yields the bucket state for reading and updating atomically """
+        with self._lock:
+            yield self._state
+
+    def _get(self, key):
+        with self._locked() as state:
+            return state[key]
+
+    def _set(self, key, value):
+        with self._locked() as state:
+            state[key] = value
+
+    limit = property(lambda self: self._get("limit"),
+                     lambda self, v: self._set("limit", v))
+    remaining = property(lambda self: self._get("remaining"),
+                         lambda self, v: self._set("remaining", v))
+    reset_at = property(lambda self: self._get("reset_at"),
+                        lambda self, v: self._set("reset_at", v))
+
+    def reserve(self, soft_threshold=None, headroom=0):
+        """ Take a token for one request. Returns the number of seconds the
+        caller must wait before sending it. Never sleeps itself, so blocking
+        and asyncio callers can share a limiter.
+
+        `soft_threshold` overrides the limiter's own for this request. When
+        `headroom` tokens or fewer remain, the request waits for the next
+        window instead, leaving them to callers with less headroom. """
+        return self._reserve(soft_threshold, headroom)[0]
+
+    def _reserve(self, soft_threshold=None, headroom=0):
+        """ reserve(), also returning why the request has to wait: "hard"
+        when the window is used up, "reserve" when held back for other
+        callers, "soft" when paced by the soft threshold, else None """
+        if soft_threshold is None:
+            soft_threshold = self.soft_threshold
+        with self._locked() as state:
+            now = time.time()
+            soft_limit = int(state["limit"] * (1 - soft_threshold))
+            if now >= state["reset_at"] and state["remaining"] < state["limit"]:
+                # The window has rolled over since we last heard from the server
+                state["remaining"] = state["limit"]
+
+            # If limit is completely exhausted, wait until full reset. Clamp to
+            # min 0 to not bomb out if reset_at is in past. The token comes out
+            # of the next window, so later callers must wait for it as well
+            if state["remaining"] <= 0:
+                must_wait = max(0, state["reset_at"] - now)
+                if must_wait >= 5:
+                    log.info("Ratelimit hit, sleeping for %.1fs", must_wait)
+                state["not_before"] = state["reset_at"]
+                state["remaining"] = state["limit"] - 1
+                return must_wait, "hard"
+
+            # The rest of this window is held back for more urgent requests
+            if state["remaining"] <= headroom:
+                return max(0, state["reset_at"] - now, state["not_before"] - now), "reserve"
+
+            # If limit is >soft_threshold % used, wait the appropriate amount
+            # to avoid hitting a big wait
+            must_wait = max(0, state["not_before"] - now)
+            reason = "hard" if must_wait > 0 else None
+            if state["remaining"] <= soft_limit:
+                sec_to_reset = state["reset_at"] - now
+                soft_wait = sec_to_reset / float(state["remaining"])
+                if soft_wait > must_wait:
+                    must_wait, reason = soft_wait, "soft"
+            state["remaining"] -= 1
+            return must_wait, reason
+
+    def update(self, headers):
+        """ Resync the bucket from a response's X-Ratelimit-* headers """
+        reset_at = time.time() + int(headers.get('X-Ratelimit-Reset', 0))
+        limit = int(headers.get('X-Ratelimit-Limit', 100))
+        remaining = int(headers.get('X-Ratelimit-Remaining', 99))
+        with self._locked() as state:
+            state["reset_at"] = reset_at
+            state["limit"] = limit
+            state["remaining"] = remaining
+
+
+class FileRateLimiter(RateLimiter):
+    """ RateLimiter whose bucket lives in a file guarded by flock, so
+    separate processes using the same API key share one budget. Unix only. """
+
+    def __init__(self, path, soft_threshold=0.5, **kwargs):
+        if fcntl is None:
+            raise ImportError("FileRateLimiter requires fcntl")
+        super(FileRateLimiter, self).__init__(soft_threshold=soft_threshold, **kwargs)
+        self.path = path
+        # Seed the file only if no other process has created it yet
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    raw = f.read()
+                    if raw:
+                        self._state = _json.loads(raw)
+                    yield self._state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(_json.dumps(self._state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RequestScheduler(object):
+    """ Hands out a RateLimiter's budget by priority lane, so a burst of
+    market data polling can't delay a cancel.
+
+    Every lane paces itself with the limiter's soft threshold unless
+    `soft_thresholds` overrides it for that lane. The account and market
+    lanes each hold back a `reserves` fraction of the limit for the lanes
+    above them. With `trade_burst` set, the trade lane ignores the soft
+    threshold and bursts up to the hard limit. """
+
+    def __init__(self, limiter=None, reserves=(0, 0.1, 0.2), soft_thresholds=(None, None, None),
+                 trade_burst=False):
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.reserves = reserves
+        self.soft_thresholds = soft_thresholds
+        self.trade_burst = trade_burst
+        self._lock = threading.Lock()
+        self._stats = [{"queued": 0, "requests": 0, "waited": 0, "wait_time": 0.0,
+                        "max_wait": 0.0, "hard_wait_time": 0.0, "soft_wait_time": 0.0,
+                        "reserve_wait_time": 0.0} for _ in LANES]
+
+    @contextmanager
+    def lane(self, priority):
+        """ Reserve budget for one request in lane `priority`. Yields the
+        number of seconds to wait before sending, which the caller must sleep
+        inside the block so the lane's queue depth stays accurate. """
+        soft_threshold = self.soft_thresholds[priority]
+        if priority == PRIORITY_TRADE and self.trade_burst:
+            soft_threshold = 1
+        must_wait, reason = self.limiter._reserve(
+            soft_threshold=soft_threshold,
+            headroom=int(self.limiter.limit * self.reserves[priority]))
+        stats = self._stats[priority]
+        with self._lock:
+            stats["requests"] += 1
+            if must_wait > 0:
+                stats["queued"] += 1
+                stats["waited"] += 1
+                stats["wait_time"] += must_wait
+                stats["max_wait"] = max(stats["max_wait"], must_wait)
+                stats[reason + "_wait_time"] += must_wait
+        try:
+            yield must_wait
+        finally:
+            if must_wait > 0:
+                with self._lock:
+                    stats["queued"] -= 1
+
+    def stats(self):
+        """ Per lane counters: requests currently waiting ("queued"), total
+        "requests", how many "waited", and their total and max wait time.
+        The total is also split by whether the hard limit, the soft
+        threshold or another lane's reserve caused the wait. """
+        with self._lock:
+            return {name: dict(st) for name, st in zip(LANES, self._stats)}
@@ -0,0 +1,205 @@
+import numbers
+from array import array
+from decimal import Decimal
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Record(object):
+    """ Fixed-field record parsed from an API object. Fields are read as
+    attributes or dict style (record['id']), so it can stand in for the dict
+    it replaces. Keys the class doesn't know about are kept in `_extra`. """
+    __slots__ = ('_extra',)
+    _fields = ()
+    _field_set = frozenset()
+
+    def __init__(self, data):
+        extra = None
+        for key, value in data.items():
+            if key in self._field_set:
+                setattr(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self._extra = extra
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [k for k in self._fields if hasattr(self, k)]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def to_dict(self):
+        """ The API object as a plain dict, without derived fields. Nested
+        records, like a market's currencies, become dicts too. """
+        return {k: _plain(self[k]) for k in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.to_dict())
+
+
+def _plain(value):
+    return value.to_dict() if isinstance(value, Record) else value
+
+
+def _record(name, fields, derived=()):
+    """ Record subclass holding `fields` from the API plus `derived` ones
+    computed when it is loaded """
+    return type(name, (Record,), {
+        '__slots__': tuple(fields) + tuple(derived),
+        '_fields': tuple(fields),
+        '_field_set': frozenset(fields),
+    })
+
+
+Currency = _record("Currency", (
+    "code", "long_name", "type", "status", "precision", "can_withdraw",
+    "config", "metadata"))
+
+Ticker = _record("Ticker", (
+    "id", "id_hr", "ask", "bid", "last", "day_avg_price", "day_change",
+    "day_high", "day_low", "day_open", "day_volume_base", "day_volume_market"))
+
+_MarketBase = _record("_MarketBase", (
+    "id", "string", "market_currency", "base_currency", "maker_fee",
+    "taker_fee", "can_trade", "can_cancel", "can_view", "metadata"),
+    derived=("fee_mult",))
+
+
+class Market(_MarketBase):
+    """ A market from /v1/common, with its currencies resolved to Currency
+    records and the fee multiplier worked out up front """
+    __slots__ = ()
+
+    def __init__(self, data, currencies):
+        super(Market, self).__init__(data)
+        self.string = "{}_{}".format(data['market_currency'], data['base_currency'])
+        self.market_currency = currencies[data['market_currency']]
+        self.base_currency = currencies[data['base_currency']]
+        fee_perc = max(Decimal(data['taker_fee']), Decimal(data['maker_fee']))
+        self.fee_mult = fee_perc + 1
+
+
+class RecordIndex(Mapping):
+    """ Records stored once in a list indexed by id, with a name to id
+    index. Looks up by either, like the dicts keyed by both it replaces.
+    Iterates over names and ids; values() yields each record once. """
+
+    def __init__(self, records, name_key):
+        records = list(records)
+        self._by_id = [None] * (max([r['id'] for r in records] or [-1]) + 1)
+        self._ids = {}
+        for record in records:
+            self._by_id[record['id']] = record
+            self._ids[record[name_key]] = record['id']
+
+    def __getitem__(self, key):
+        # Integral takes numpy ids too, e.g. from TickerColumns.as_numpy()
+        if not isinstance(key, numbers.Integral):
+            key = self._ids[key]
+        try:
+            record = self._by_id[key] if key >= 0 else None
+        except IndexError:
+            record = None
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __iter__(self):
+        for name, id in self._ids.items():
+            yield name
+            yield id
+
+    def __len__(self):
+        return 2 * len(self._ids)
+
+    def values(self):
+        return [r for r in self._by_id if r is not None]
+
+    def names(self):
+        """ Every name, e.g. market string, in the index """
+        return list(self._ids)
+
+
+def _float(value):
+    return float("nan") if value is None else float(value)
+
+
+class TickerColumns(object):
+    """ Tickers as parallel columns, one row per market, for scanning every
+    market at once. Prices and volumes are floats, NaN where the API gave
+    None. Build it once per tickers snapshot. """
+
+    columns = ("bid", "ask", "last", "day_volume_base", "day_volume_market")
+
+    def __init__(self, tickers):
+        tickers = list(tickers)
+        self.ids = array('l', [t['id'] for t in tickers])
+        self.names = [t['id_hr'] for t in tickers]
+        for name in self.columns:
+            setattr(self, name, array('d', [_float(t.get(name)) for t in tickers]))
+        self._rows = {}
+        for row, ticker in enumerate(tickers):
+            self._rows[ticker['id']] = row
+            self._rows[ticker['id_hr']] = row
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, key):
+        """ Row of a market, by id or market string """
+        return self._rows[key]
+
+    def as_numpy(self):
+        """ Dict of numpy arrays sharing the columns' memory, with "id" for
+        the market ids. Requires numpy. """
+        if numpy is None:
+            raise ImportError("as_numpy requires numpy")
+        cols = {name: numpy.frombuffer(getattr(self, name), dtype=numpy.float64)
+                for name in self.columns}
+        cols["id"] = numpy.array(self.ids, dtype=numpy.int64)
+        return cols
@@ -0,0 +1,96 @@
+import codecs
+import json as _json
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+class _Reader(object):
+    """ Text buffer over an iterator of byte chunks, refilled on demand """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf8")()
+        self._json = _json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self):
+        """ Append the next chunk to the buffer. Returns False at the end of
+        the stream. """
+        if self.exhausted:
+            return False
+        # Drop what has been consumed so the buffer stays small
+        if self.pos > 65536:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self._decoder.decode(b"", final=True)
+        self.exhausted = True
+        return False
+
+    def peek(self):
+        """ Next non-whitespace character without consuming it """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected {!r} at offset {} of JSON stream".format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """ Decode the next complete JSON value """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next
+            # chunk, and "12." decodes as 12 until the digits after it arrive
+            if (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks, path):
+    """ Yield the items of the array found by following the object keys in
+    `path` (e.g. ("data", "orders")) through a JSON document arriving as byte
+    `chunks`. Items are yielded as soon as they are complete, so only one
+    item at a time is held in memory. Values before the array are decoded
+    and discarded; anything after it is never read. """
+    reader = _Reader(chunks)
+    for key in path:
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                raise ValueError("Key {!r} not found in JSON stream".format(key))
+            name = reader.value()
+            reader.expect(":")
+            if name == key:
+                break
+            reader.value()
+            if reader.peek() == ",":
+                reader.pos += 1
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() == "]":
+            return
+        reader.expect(",")
@@ -7,12 +7,19 @@ setup(
     name='qtrade_client',
     install_requires=[
         'click>=6.7',
-        'requests>=2.20.0'
+        'PyYAML>=3.13',
+        'requests>=2.20.0',
+        'futures>=3.0; python_version < "3"',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.3'],
+        'fast': ['orjson'],
+        'numpy': ['numpy'],
+    },
     version='0.1',
     packages=['qtrade_client', 'qtrade_client.cli'],
     python_requires='>=2.7.0',
     entry_points={
-        'console_scripts': ['qtapi = qtrade.cli:entry'],
+        'console_scripts': ['qtapi = qtrade_client.cli:entry'],
     },
 )
@@ -0,0 +1,10 @@
+import sys
+
+# The asyncio client uses async/await syntax
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append("test_async_api.py")
+# The cli reads its config dir with os.scandir (3.5), st_mtime_ns and
+# os.replace
+if sys.version_info < (3, 5):
+    collect_ignore.append("test_cli.py")
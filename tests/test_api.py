@@ -2,15 +2,19 @@ import pytest
 import json
 import requests
 import copy
+import logging
 
 try:
     import unittest.mock as mock
 except ImportError:
     import mock
+import threading
 import time
 from decimal import Decimal
 
-from qtrade_client.api import QtradeAPI, QtradeAuth, APIException, hmac_generate
+from qtrade_client.api import (QtradeAPI, QtradeAuth, APIException, hmac_generate,
+                               to_satoshi)
+from qtrade_client.codec import JSONCodec, default_codec
 
 
 @pytest.fixture
@@ -204,6 +208,25 @@ def test_query_hmac_bytes(api):
                   _time=12345)
 
 
+def test_hmac_body_types():
+    key = "1111111111111111111111111111111111111111111111111111111111111111"
+    sig = hmac_generate(key, "/v1/user/sell_limit", "POST", body=u'{"a": "\u00e9"}', _time=1)
+    assert sig == hmac_generate(key, "/v1/user/sell_limit", "POST",
+                                body=u'{"a": "\u00e9"}'.encode('utf8'), _time=1)
+    assert hmac_generate(key, "/v1/common", "GET", _time=1) == \
+        hmac_generate(key, "/v1/common", "GET", body=b"", _time=1)
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=12345))
+def test_auth_uri_cache():
+    auth = QtradeAuth("1:1111111111111111111111111111111111111111111111111111111111111111")
+    url = "https://api.qtrade.io/v1/user/orders?open=false"
+    first = auth(requests.Request("GET", url).prepare()).headers["Authorization"]
+    assert auth._uri_cache == {url: "/v1/user/orders?open=false"}
+    again = auth(requests.Request("GET", url).prepare()).headers["Authorization"]
+    assert first == again == "HMAC-SHA256 1:4S8CauoSJcBbQsdcqpqvzN/aFyVJgADXU05eppDxiFA="
+
+
 @mock.patch("time.time", mock.MagicMock(return_value=10))
 def test_hard_limit(api):
     api.rl_remaining = 0
@@ -443,10 +466,17 @@ def test_refresh_common(api):
         "market_currency": "BIS",
         "metadata": {"labels": []},
         "taker_fee": "0.005"}]}
-    api._req = mock.MagicMock(return_value=ret)
-    assert api.markets["GRIN_BTC"] == ret["markets"][0]
-    assert api.markets["LTC_BTC"] == ret["markets"][1]
-    assert api.markets["BIS_BTC"] == ret["markets"][2]
+    api._req = mock.MagicMock(return_value=copy.deepcopy(ret))
+    for raw in ret["markets"]:
+        market = api.markets["{market_currency}_{base_currency}".format(**raw)]
+        assert market is api.markets[raw["id"]]
+        assert market["base_currency"] is api.currencies[raw["base_currency"]]
+        assert market["market_currency"] is api.currencies[raw["market_currency"]]
+        assert market["taker_fee"] == raw["taker_fee"]
+        assert market["metadata"] == raw["metadata"]
+    assert api.markets["GRIN_BTC"].fee_mult == Decimal("1.0075")
+    assert sorted(api.markets.names()) == ["BIS_BTC", "GRIN_BTC", "LTC_BTC"]
+    assert len(api.markets.values()) == 3
     assert api.currencies["GRIN"] == ret["currencies"][0]
     assert api.currencies["LTC"] == ret["currencies"][1]
     assert api.currencies["BTC"] == ret["currencies"][2]
@@ -486,6 +516,49 @@ def test_refresh_tickers(api):
     api._req = mock.MagicMock(return_value=ret)
     assert api.tickers[20] == api.tickers["BIS_BTC"] == ret['markets'][0]
     assert api.tickers[8] == api.tickers["MMO_BTC"] == ret['markets'][1]
+    assert api.tickers[8] is api.tickers["MMO_BTC"]
+    assert "BIS_BTC" in api.tickers and 21 not in api.tickers
+    with pytest.raises(KeyError):
+        api.tickers[21]
+
+
+def test_stale_tickers_refresh_in_background(api):
+    old = {"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "1"}]}
+    new = {"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "2"}]}
+    api._load_tickers(old)
+    api._tickers_age -= 200
+    api.max_staleness = 600
+    release = threading.Event()
+
+    def slow_get(endpoint):
+        release.wait(5)
+        return new
+    api.get = mock.MagicMock(side_effect=slow_get)
+    # The stale snapshot comes back straight away, and one fetch starts
+    assert api.tickers["LTC_BTC"]["last"] == "1"
+    assert api.tickers["LTC_BTC"]["last"] == "1"
+    release.set()
+    with api._refresh_locks["tickers"]:
+        pass
+    assert api.get.call_count == 1
+    assert api.tickers["LTC_BTC"]["last"] == "2"
+
+
+def test_expired_tickers_block(api):
+    api._load_tickers({"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "1"}]})
+    api._tickers_age -= 700
+    api.max_staleness = 600
+    api.get = mock.MagicMock(return_value={"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "2"}]})
+    assert api.tickers["LTC_BTC"]["last"] == "2"
+
+
+def test_fresh_tickers_max_age(api):
+    api._load_tickers({"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "1"}]})
+    api._tickers_age -= 10
+    api.get = mock.MagicMock(return_value={"markets": [{"id": 1, "id_hr": "LTC_BTC", "last": "2"}]})
+    assert api.tickers["LTC_BTC"]["last"] == "1"
+    assert api.fresh_tickers(5)["LTC_BTC"]["last"] == "2"
+    api.get.assert_called_once_with("/v1/tickers")
 
 
 def test_orders(api):
@@ -760,3 +833,353 @@ def test_cancel_market_orders_no_string_id(api):
 def test_cancel_market_orders_both_string_id(api):
     with pytest.raises(ValueError):
         api.cancel_market_orders(market_string="LTC_BTC", market_id=36)
+
+
+def test_cancel_orders_report(api):
+    def post(endpoint, json):
+        if json['id'] == 2:
+            raise APIException("Invalid return code from backend", 404, ["not_found"])
+        if json['id'] == 3:
+            raise APIException("Invalid return code from backend", 500, ["internal_error"])
+
+    api.post = mock.MagicMock(side_effect=post)
+    report = api.cancel_orders([1, 2, 3])
+    assert report == {
+        1: {"status": "cancelled"},
+        2: {"status": "gone", "code": 404, "errors": ["not_found"]},
+        3: {"status": "failed", "code": 500, "errors": ["internal_error"]},
+    }
+
+
+def test_cancel_orders_serial_when_ratelimited(api):
+    api.rl_remaining = 1
+    api.post = mock.MagicMock()
+    with mock.patch("qtrade_client.api.ThreadPoolExecutor") as pool:
+        report = api.cancel_orders([1, 2])
+    assert not pool.called
+    assert report == {1: {"status": "cancelled"}, 2: {"status": "cancelled"}}
+
+
+def test_place_orders(api_with_market):
+    api = api_with_market
+    api._req = mock.MagicMock(return_value=order_return)
+    results = dict(api.place_orders([
+        {"order_type": "buy_limit", "price": 0.005, "value": 0.01, "market_id": 1},
+        {"order_type": "sell_limit", "price": 1, "amount": 0.01, "market_string": "LTC_BTC"},
+        {"order_type": "buy_limit", "price": 0.1, "value": 0.01, "market_id": 1, "prevent_taker": True},
+    ]))
+    assert results == {0: order_return, 1: order_return, 2: "order not placed"}
+    api._req.assert_has_calls([
+        mock.call('post', '/v1/user/buy_limit', amount='1.99004975', market_id=1, price='0.00500000'),
+        mock.call('post', '/v1/user/sell_limit', amount='0.01', market_id=1, price='1.00000000'),
+    ], any_order=True)
+    assert api._req.call_count == 2
+
+
+def test_place_orders_validates_first(api_with_market):
+    api = api_with_market
+    api._req = mock.MagicMock(return_value=order_return)
+    with pytest.raises(ValueError):
+        api.place_orders([
+            {"order_type": "sell_limit", "price": 1, "amount": 0.01, "market_id": 1},
+            {"order_type": "sell_limit", "price": 1, "market_id": 1},
+        ])
+    assert not api._req.called
+
+
+def test_place_orders_sent_without_reading_results(api_with_market):
+    api = api_with_market
+    sent = threading.Semaphore(0)
+    api._req = mock.MagicMock(side_effect=lambda *args, **kwargs: (sent.release(), order_return)[1])
+    api.place_orders([
+        {"order_type": "buy_limit", "price": 0.005, "value": 0.01, "market_id": 1},
+        {"order_type": "sell_limit", "price": 1, "amount": 0.01, "market_id": 1},
+    ])
+    # Never iterated, yet both orders go out
+    for _ in range(2):
+        sent.acquire()
+    assert api._req.call_count == 2
+
+
+def test_place_orders_failure(api_with_market):
+    api = api_with_market
+    err = APIException("Invalid return code from backend", 400, ["insufficient_funds"])
+    api._req = mock.MagicMock(side_effect=err)
+    results = list(api.place_orders([
+        {"order_type": "sell_limit", "price": 1, "amount": 0.01, "market_id": 1},
+    ]))
+    assert results == [(0, err)]
+
+
+def test_satoshi_conversion():
+    assert to_satoshi("0.5672848") == 56728480
+    assert to_satoshi("-0.00000001") == -1
+    assert to_satoshi("0.123456785") == 12345678
+    assert to_satoshi(Decimal("1.5")) == 150000000
+
+
+def test_iter_records(api):
+    body = json.dumps({"data": {"orders": [{"id": 1}, {"id": 2}]}}).encode('utf8')
+    res = mock.MagicMock(status_code=200, headers={})
+    res.iter_content.return_value = [body[:10], body[10:]]
+    api.rs.request = mock.MagicMock(return_value=res)
+    assert list(api.iter_records("/v1/user/orders", "orders", open="true")) == [{"id": 1}, {"id": 2}]
+    assert api.rs.request.call_args[1]["stream"] is True
+    assert api.rs.request.call_args[1]["params"] == {"open": "true"}
+    assert res.close.called
+
+
+def test_iter_records_error(api):
+    res = mock.MagicMock(status_code=404, headers={}, content=b'{"errors": [{"code": "not_found"}]}')
+    api.rs.request = mock.MagicMock(return_value=res)
+    with pytest.raises(APIException) as e:
+        list(api.iter_records("/v1/user/orders", "orders"))
+    assert e.value.errors == ["not_found"]
+
+
+def test_post_body_encoded_once(api):
+    api.codec = mock.MagicMock(wraps=JSONCodec())
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {"ok": true}}'))
+    assert api.post("/v1/user/cancel_order", id=5) == {"ok": True}
+    api.codec.dumps.assert_called_once_with({"id": 5})
+    kwargs = api.rs.request.call_args[1]
+    assert kwargs["data"] == b'{"id": 5}'
+    assert kwargs["headers"]["Content-Type"] == "application/json"
+
+
+@pytest.mark.parametrize("codec", [JSONCodec(), default_codec()])
+def test_codec_roundtrip(codec):
+    obj = {"amount": "0.01", "market_id": 1, "name": u"\u00e9"}
+    assert codec.loads(codec.dumps(obj)) == obj
+
+
+def test_trace_hook(api):
+    api.trace_hook = mock.MagicMock()
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {}}'))
+    api.get("/v1/common")
+    trace = api.trace_hook.call_args[0][0]
+    assert (trace.method, trace.endpoint, trace.status, trace.bytes) == ("GET", "/v1/common", 200, 12)
+    assert trace.latency >= 0
+
+
+def test_debug_payload_is_lazy(api):
+    class Exploding(dict):
+        def __repr__(self):
+            raise AssertionError("payload formatted with debug logging off")
+
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(status_code=200, headers={}))
+    api.codec = mock.MagicMock()
+    api.codec.loads.return_value = Exploding(data=1)
+    logger = logging.getLogger("qtrade")
+    with mock.patch.object(logger, "level", logging.INFO):
+        assert api.get("/v1/common") == 1
+
+
+def test_log_payload_truncated(api, caplog):
+    api.log_payload_limit = 10
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=500, headers={}, content=b"x" * 100, text="x" * 100))
+    with pytest.raises(APIException):
+        api.get("/v1/common")
+    assert "xxxxxxxxxx... (100 chars)" in caplog.text
+
+
+def test_coalesced_gets_share_one_request(api):
+    api.coalesce_gets = True
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_request(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return mock.MagicMock(status_code=200, headers={}, content=b'{"data": {"n": 1}}')
+    api.rs.request = mock.MagicMock(side_effect=slow_request)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(api.get("/v1/tickers")))
+    leader.start()
+    started.wait(5)
+    # Count the followers waiting on the request in flight
+    future, = api._inflight.values()
+    waiting = threading.Semaphore(0)
+    result = future.result
+    future.result = lambda *args: (waiting.release(), result(*args))[1]
+    followers = [threading.Thread(target=lambda: results.append(api.get("/v1/tickers", priority=0)))
+                 for _ in range(3)]
+    for t in followers:
+        t.start()
+    for t in followers:
+        waiting.acquire()
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert results == [{"n": 1}] * 4
+    assert api.rs.request.call_count == 1
+    # A different query is a different request
+    api.get("/v1/tickers", foo="bar")
+    assert api.rs.request.call_count == 2
+
+
+def test_coalesced_get_errors_shared(api):
+    api.coalesce_gets = True
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=404, headers={}, content=b'{"errors": [{"code": "not_found"}]}'))
+    with pytest.raises(APIException):
+        api.get("/v1/ticker/NOPE_BTC")
+    assert api._inflight == {}
+
+
+def test_get_cache_ttl(api):
+    api.get_cache_ttl = {"/v1/tickers": 1}
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {"n": 1}}'))
+    with mock.patch("time.time", mock.MagicMock(return_value=100)):
+        assert api.get("/v1/tickers") == api.get("/v1/tickers") == {"n": 1}
+        api.get("/v1/common")
+        api.get("/v1/common")
+    assert api.rs.request.call_count == 3
+    with mock.patch("time.time", mock.MagicMock(return_value=101.5)):
+        api.get("/v1/tickers")
+    assert api.rs.request.call_count == 4
+
+
+@pytest.mark.parametrize("method,endpoint,kwargs", [
+    ("get", "/v1/user/orders", {"open": "true", "older_than": None}),
+    ("get", "/v1/common", {}),
+    ("post", "/v1/user/cancel_order", {"id": 5}),
+])
+def test_prepared_requests_match_session_request(method, endpoint, kwargs):
+    api = QtradeAPI("http://localhost:9898/", key="1:" + "1" * 64)
+    api.rs.headers["X-Client"] = "test"
+    api.rs.send = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {}}'))
+    sent = []
+    with mock.patch("time.time", mock.MagicMock(return_value=100)):
+        for prepared in (False, True, True):
+            api.prepared_requests = prepared
+            getattr(api, method)(endpoint, **kwargs)
+            req, send_kwargs = api.rs.send.call_args
+            sent.append((req[0].method, req[0].url, req[0].body, dict(req[0].headers),
+                         sorted(send_kwargs.items(), key=str)))
+    assert sent[0] == sent[1] == sent[2]
+    assert sent[0][3]["X-Client"] == "test"
+    assert sent[0][3]["Authorization"].startswith("HMAC-SHA256 1:")
+
+
+def test_prepared_request_templates_cached(api):
+    api.prepared_requests = True
+    api.rs.merge_environment_settings = mock.MagicMock(wraps=api.rs.merge_environment_settings)
+    api.rs.send = api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {}}'))
+    for i in range(3):
+        api.post("/v1/user/cancel_order", id=i)
+    assert api.rs.merge_environment_settings.call_count == 1
+    assert json.loads(api.rs.send.call_args[0][0].body.decode('utf8')) == {"id": 2}
+    # Per call session options aren't part of a template
+    api.get("/v1/common", verify=False)
+    assert api.rs.request.call_args[1]["verify"] is False
+    api.clear_request_templates()
+    api.post("/v1/user/cancel_order", id=3)
+    assert api.rs.merge_environment_settings.call_count == 2
+
+
+def test_pool_options():
+    import socket
+    options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    api = QtradeAPI("http://localhost:9898/", pool_size=32, keep_alive=False, socket_options=options)
+    assert api.rs.get_adapter("https://api.qtrade.io") is api.adapter
+    pool_kw = api.adapter.poolmanager.connection_pool_kw
+    assert (pool_kw["maxsize"], pool_kw["socket_options"]) == (32, options)
+    assert api.rs.headers["Connection"] == "close"
+    clone = api.clone()
+    assert (clone.pool_size, clone.keep_alive, clone.socket_options) == (32, False, options)
+    assert "socket_options" not in QtradeAPI("http://localhost:9898/").adapter.poolmanager.connection_pool_kw
+
+
+def test_warmup_opens_connections():
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            connections.append(self.client_address)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.send_header("X-Ratelimit-Limit", "60")
+            self.send_header("X-Ratelimit-Remaining", "57")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        api = QtradeAPI("http://127.0.0.1:{}/".format(server.server_address[1]), pool_size=3)
+        api._refresh_common = mock.MagicMock()
+        api._refresh_tickers = mock.MagicMock()
+        assert api.warmup(5) == 3
+        assert len(connections) == 3
+        api._refresh_common.assert_called_once_with()
+        api._refresh_tickers.assert_called_once_with()
+        # The limiter follows the exchange's count of the HEAD requests
+        assert api.limiter.remaining == 57
+        # Connections already open are reused rather than opened again
+        assert api.warmup(2) == 2
+        assert len(connections) == 3
+        api.adapter.close()
+        api.keep_alive = False
+        assert api.warmup() == 0
+        assert len(connections) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_warmup_survives_unreachable_endpoint():
+    import socket
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    api = QtradeAPI("http://127.0.0.1:{}/".format(port))
+    api._refresh_common = mock.MagicMock()
+    api._refresh_tickers = mock.MagicMock()
+    assert api.warmup(2) == 0
+    api._refresh_tickers.assert_called_once_with()
+
+
+def test_warmup_survives_unexpected_errors():
+    api = QtradeAPI("http://localhost:9898/", pool_size=3)
+    api._refresh_common = mock.MagicMock()
+    api._refresh_tickers = mock.MagicMock()
+    calls = []
+
+    def head(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 2:
+            # e.g. the OSError requests raises for a missing CA bundle
+            raise ValueError("bad cert path")
+        return mock.MagicMock(headers={})
+    api.rs.head = head
+    api.warmup_timeout = 5
+    start = time.time()
+    assert api.warmup(3) == 2
+    # Every worker reported in, so none waited out the timeout
+    assert time.time() - start < 5
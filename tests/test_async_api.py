@@ -0,0 +1,162 @@
+import asyncio
+import json
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+import pytest
+from decimal import Decimal
+
+from qtrade_client.api import APIException, hmac_generate
+from qtrade_client.async_api import AsyncQtradeAPI
+
+
+class FakeResponse(object):
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def read(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeSession(object):
+    """ Records requests and replays canned responses in order """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        self.calls.append((method, url, headers, data))
+        return self.responses.pop(0)
+
+
+def ok(data, **kwargs):
+    return FakeResponse(200, json.dumps({"data": data}).encode('utf8'), **kwargs)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def api():
+    return AsyncQtradeAPI("http://localhost:9898/")
+
+
+def test_get_params(api):
+    api._session = FakeSession(ok({"orders": []}))
+    assert run(api.orders(open=True)) == []
+    method, url, headers, data = api._session.calls[0]
+    assert method == "GET"
+    assert url == "http://localhost:9898/v1/user/orders?open=true"
+    assert data is None
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=12345))
+def test_post_hmac(api):
+    api.set_hmac("1:1111111111111111111111111111111111111111111111111111111111111111")
+    api._session = FakeSession(ok({"order": {}}))
+    run(api.post("/v1/user/cancel_order", json={"id": 5}))
+    method, url, headers, data = api._session.calls[0]
+    assert method == "POST"
+    assert json.loads(data.decode('utf8')) == {"id": 5}
+    _, signature = hmac_generate(api.key, url, "POST", body=data, _time=12345)
+    assert headers["Authorization"] == "HMAC-SHA256 1:" + signature
+    assert headers["HMAC-Timestamp"] == "12345"
+
+
+def test_balances_all(api):
+    api._session = FakeSession(ok({
+        "balances": [{"currency": "BTC", "balance": "0.1970952"}],
+        "order_balances": [{"currency": "BTC", "balance": "0.1708"}],
+    }))
+    assert run(api.balances_all()) == {
+        "spendable": {"BTC": Decimal("0.1970952")},
+        "in_orders": {"BTC": Decimal("0.1708")},
+    }
+
+
+def test_429_status(api):
+    api._session = FakeSession(FakeResponse(429, b""), FakeResponse(429, b""))
+    with pytest.raises(APIException):
+        run(api.get("/v1/common"))
+    assert len(api._session.calls) == 2
+
+
+def test_error_codes(api):
+    body = json.dumps({"errors": [{"code": "not_found"}]}).encode('utf8')
+    api._session = FakeSession(FakeResponse(404, body))
+    with pytest.raises(APIException) as e:
+        run(api.get("/v1/user/order/1"))
+    assert e.value.code == 404
+    assert e.value.errors == ["not_found"]
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_hard_limit_does_not_block(api):
+    api.rl_remaining = 0
+    api.rl_reset_at = 15
+    api._session = FakeSession(ok({}))
+    real_sleep = asyncio.sleep
+    # Sleeping for real would take 5s, so make it instant
+    sleep = mock.MagicMock(side_effect=lambda s: real_sleep(0))
+    with mock.patch("asyncio.sleep", sleep):
+        with mock.patch("time.sleep") as blocking_sleep:
+            run(api.get("/v1/common"))
+    sleep.assert_called_with(5)
+    assert not blocking_sleep.called
+
+
+def test_cancel_market_orders(api):
+    api._markets_map = {"LTC_BTC": {"id": 1}, 1: {"id": 1}}
+    api._markets_age = float("inf")
+    ords = [{"id": 3, "market_id": 1}, {"id": 2, "market_id": 1}, {"id": 1, "market_id": 36}]
+    api._session = FakeSession(ok({"orders": ords}), ok({}), ok({}))
+    run(api.cancel_market_orders(market_string="LTC_BTC"))
+    posted = sorted(json.loads(c[3].decode('utf8'))["id"] for c in api._session.calls[1:])
+    assert posted == [2, 3]
+
+
+def test_stale_markets_refresh_in_background(api):
+    api._markets_map = {"LTC_BTC": {"id": 1}, 1: {"id": 1}}
+    api._currencies_map = {}
+    api._markets_age = 0
+    api.max_staleness = float("inf")
+    common = {"currencies": [{"code": "LTC"}, {"code": "BTC"}],
+              "markets": [{"id": 2, "market_currency": "LTC", "base_currency": "BTC",
+                          "maker_fee": "0", "taker_fee": "0.005"}]}
+    api._session = FakeSession(ok(common))
+
+    async def go():
+        stale = await api.markets()
+        await api._refresh_tasks["common"]
+        return stale, await api.markets()
+    stale, markets = run(go())
+    assert stale["LTC_BTC"]["id"] == 1
+    assert markets["LTC_BTC"]["id"] == 2
+    assert len(api._session.calls) == 1
+
+
+def test_async_poller(api):
+    from qtrade_client.async_api import AsyncPoller
+    api._session = FakeSession(ok({"balances": []}), ok({"markets": []}))
+    poller = AsyncPoller(api)
+    got = []
+    poller.subscribe("/v1/user/balances", 5, got.append)
+    poller.subscribe("/v1/tickers", 5, got.append)
+    run(poller.poll_once())
+    assert sorted(got, key=str) == [{"balances": []}, {"markets": []}]
@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+click = pytest.importorskip("click")
+pytest.importorskip("yaml")
+from click.testing import CliRunner  # noqa: E402
+
+from qtrade_client import cli as qtcli  # noqa: E402
+
+CONFIG = """prod:
+  endpoint: https://api.qtrade.io
+  email: ops@example.com
+  key: "1:1111111111111111111111111111111111111111111111111111111111111111"
+"""
+
+
+@pytest.fixture
+def cfg_dir(tmpdir):
+    tmpdir.join("prod.yml").write(CONFIG)
+    tmpdir.join("broken.yml").write("- not a mapping")
+    tmpdir.join(".default_context").write("prod\n")
+    return str(tmpdir)
+
+
+def entry_point(name, command):
+    ep = mock.MagicMock()
+    ep.name = name
+    ep.load.return_value = command
+    return ep
+
+
+@pytest.fixture
+def plugins():
+    hello = click.Command("hello", callback=lambda: click.echo("hi"))
+    eps = [entry_point("hello", hello), entry_point("other", click.Command("other"))]
+    with mock.patch.object(qtcli, "plugin_entry_points", return_value=eps):
+        qtcli.cli._plugins = None
+        yield eps
+    qtcli.cli._plugins = None
+    for ep in eps:
+        qtcli.cli.commands.pop(ep.name, None)
+
+
+def test_load_contexts(cfg_dir, caplog):
+    contexts, default = qtcli.load_contexts(cfg_dir)
+    assert default == "prod"
+    assert contexts["prod"]["endpoint"] == "https://api.qtrade.io"
+    assert contexts["prod"]["origin"].endswith("prod.yml")
+    assert "dev_root" in contexts
+    assert "Failed to parse config" in caplog.text
+
+
+def test_missing_config_dir(tmpdir):
+    contexts, default = qtcli.load_contexts(str(tmpdir.join("nope")))
+    assert default == "dev_root" and list(contexts) == ["dev_root"]
+
+
+def test_plugins_listed_without_loading(plugins):
+    ctx = click.Context(qtcli.cli)
+    assert qtcli.cli.list_commands(ctx) == ["daemon", "hello", "other"]
+    assert not any(ep.load.called for ep in plugins)
+
+
+def test_only_invoked_plugin_loaded(plugins, cfg_dir):
+    result = CliRunner().invoke(qtcli.cli, ["-d", cfg_dir, "hello"], obj={})
+    assert result.exit_code == 0, result.output
+    assert "using profile" in result.output and "ops@example.com" in result.output
+    assert result.output.endswith("hi\n")
+    assert plugins[0].load.called and not plugins[1].load.called
+
+
+def test_unknown_context(plugins, cfg_dir):
+    result = CliRunner().invoke(qtcli.cli, ["-d", cfg_dir, "-c", "nope", "hello"], obj={})
+    assert result.exit_code == 1
+
+
+def test_config_cache(cfg_dir, caplog):
+    qtcli.load_contexts(cfg_dir)
+    caplog.clear()
+    with mock.patch.object(qtcli, "parse_config", wraps=qtcli.parse_config) as parse:
+        contexts, _ = qtcli.load_contexts(cfg_dir)
+        assert not parse.called
+        assert contexts["prod"]["email"] == "ops@example.com"
+        # A bad file is only warned about when it changes
+        assert "Failed to parse config" not in caplog.text
+
+        with open(contexts["prod"]["origin"], "a") as f:
+            f.write("staging:\n  endpoint: https://staging.example.com\n")
+        contexts, _ = qtcli.load_contexts(cfg_dir)
+        assert parse.call_count == 1
+        assert contexts["staging"]["endpoint"] == "https://staging.example.com"
+
+
+def test_config_cache_drops_removed_files(cfg_dir):
+    qtcli.load_contexts(cfg_dir)
+    os.remove(os.path.join(cfg_dir, "prod.yml"))
+    contexts, _ = qtcli.load_contexts(cfg_dir)
+    assert "prod" not in contexts
+    with open(os.path.join(cfg_dir, qtcli.CACHE_FILE)) as f:
+        assert sorted(json.load(f)["files"]) == ["broken.yml"]
+
+
+def test_corrupt_cache_ignored(cfg_dir):
+    with open(os.path.join(cfg_dir, qtcli.CACHE_FILE), "w") as f:
+        f.write("{not json")
+    contexts, _ = qtcli.load_contexts(cfg_dir)
+    assert "prod" in contexts
@@ -0,0 +1,122 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.api import APIException
+from qtrade_client.daemon import DaemonServer, DaemonQtradeAPI, DaemonError
+
+KEY = "1:1111111111111111111111111111111111111111111111111111111111111111"
+
+
+def response(status, body):
+    return mock.MagicMock(status_code=status, headers={}, content=json.dumps(body).encode())
+
+
+@pytest.fixture
+def server(tmpdir):
+    server = DaemonServer(str(tmpdir.join("qtapi.sock")))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http():
+    with mock.patch("requests.Session.request") as request:
+        request.return_value = response(200, {"data": {"n": 1}})
+        yield request
+
+
+def client(server, **kwargs):
+    return DaemonQtradeAPI("http://localhost:9898", context="dev", key=KEY,
+                           socket_path=server.path, **kwargs)
+
+
+def test_requests_forwarded_to_warm_client(server, http):
+    first = client(server)
+    first.rs.request = mock.MagicMock()
+    assert first.get("/v1/common") == {"n": 1}
+    assert first.post("/v1/user/cancel_order", id=5) == {"n": 1}
+    # A later process gets the daemon's cached market data
+    second = client(server)
+    assert second.get("/v1/common") == {"n": 1}
+    assert not first.rs.request.called
+    assert http.call_count == 2
+    assert len(server.clients) == 1
+    sent = http.call_args[1]
+    assert json.loads(sent["data"].decode()) == {"id": 5}
+    warm, = server.clients.values()
+    assert warm.rs.auth is not None
+
+
+def test_errors_forwarded(server, http):
+    http.return_value = response(400, {"errors": [{"code": "invalid_amount"}]})
+    with pytest.raises(APIException) as e:
+        client(server).post("/v1/user/sell_limit", amount="0")
+    assert (e.value.code, e.value.errors) == (400, ["invalid_amount"])
+    http.side_effect = ValueError("boom")
+    with pytest.raises(DaemonError):
+        client(server).get("/v1/user/balances")
+
+
+def test_falls_back_without_daemon(tmpdir):
+    api = DaemonQtradeAPI("http://localhost:9898", socket_path=str(tmpdir.join("none.sock")))
+    api.rs.request = mock.MagicMock(return_value=response(200, {"data": {"n": 2}}))
+    assert api.get("/v1/common") == {"n": 2}
+    assert api.get("/v1/tickers") == {"n": 2}
+    assert api._daemon_down
+
+
+def test_lost_connection_during_post(server, http):
+    api = client(server)
+    api.rs.request = mock.MagicMock(return_value=response(200, {"data": {"n": 2}}))
+    api._connect()
+    api._rfile = mock.MagicMock(readline=mock.MagicMock(return_value=b""))
+    # The order may have gone out, so it is not sent again in-process
+    with pytest.raises(Exception) as e:
+        api.post("/v1/user/sell_limit", amount="1")
+    assert "Lost the daemon connection" in str(e.value)
+    assert not api.rs.request.called
+
+
+def test_stale_socket_replaced(tmpdir):
+    path = str(tmpdir.join("qtapi.sock"))
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = DaemonServer(path)
+    try:
+        assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+        with pytest.raises(RuntimeError):
+            DaemonServer(path)
+    finally:
+        server.server_close()
+    assert not os.path.exists(path)
+
+
+def test_cached_market_data_keeps_its_age(server, http):
+    http.return_value = response(200, {"data": {"markets": [{"id": 1, "id_hr": "LTC_BTC"}]}})
+    client(server).tickers
+    warm, = server.clients.values()
+    # Backdate the daemon's copy as if fetched 100s ago
+    key, (expires, (data, fetched_at)) = next(iter(warm._get_cache.items()))
+    warm._get_cache[key] = (expires, (data, fetched_at - 100))
+    api = client(server)
+    assert api.tickers["LTC_BTC"]["id"] == 1
+    assert http.call_count == 1
+    assert 99 < time.time() - api._tickers_age < 105
+    # Asking for fresher data than the daemon holds fetches it again
+    api.fresh_tickers(5)
+    assert http.call_count == 2
+    assert time.time() - api._tickers_age < 5
@@ -0,0 +1,114 @@
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.history import OrderHistory, parse_time
+
+
+def make_order(order_id, open=False, market_id=1, created_at="2019-11-14T16:34:20.424601Z", trades=None):
+    return {
+        "id": order_id,
+        "market_amount": "0.5672848",
+        "market_amount_remaining": "0" if not open else "0.5672848",
+        "created_at": created_at,
+        "price": "0.00651044",
+        "base_amount": "0.00371174",
+        "order_type": "buy_limit",
+        "market_id": market_id,
+        "open": open,
+        "trades": trades,
+    }
+
+
+def test_parse_time():
+    assert parse_time("1970-01-01T00:00:01.5Z") == 1500000
+    assert parse_time("1970-01-01T00:00:02Z") == 2000000
+
+
+TRADE = {"id": 77, "market_amount": "0.1", "price": "0.00651044",
+         "base_amount": "0.00065104", "base_fee": "0.00000325",
+         "taker": True, "created_at": "2019-11-14T16:35:00Z"}
+
+
+def test_sync_and_reload(tmpdir):
+    path = str(tmpdir.join("history"))
+    api = mock.MagicMock()
+    calls = []
+
+    def orders(older_than=None, newer_than=None, open=None):
+        calls.append((older_than, newer_than, open))
+        if open or older_than or newer_than:
+            return []
+        return [make_order(3, market_id=2), make_order(2, open=True), make_order(1, trades=[TRADE])]
+    api.orders.side_effect = orders
+    hist = OrderHistory(path, api)
+    assert hist.sync() == 2
+    assert calls == [(None, None, None), (1, None, None)]
+    # Order 2 is still open; it is tracked rather than holding the
+    # watermark back
+    assert hist.watermark == 3
+    assert hist.open_ids == {2}
+
+    # Only the delta and the open orders are asked for. Order 2 is gone
+    # from the open ones, so it is fetched by id
+    calls[:] = []
+    api.get.return_value = {"order": make_order(2)}
+    assert hist.sync() == 1
+    assert calls == [(None, 3, None), (None, None, True)]
+    api.get.assert_called_once_with("/v1/user/order/2")
+    assert hist.open_ids == set()
+
+    hist = OrderHistory(path)
+    assert list(hist.orders.data["id"]) == [1, 3, 2]
+    assert hist.orders.data["price"][0] == 651044
+    assert hist.watermark == 3
+    assert hist.open_ids == set()
+    assert list(hist.trades.data["base_fee"]) == [325]
+    assert list(hist.trades.data["taker"]) == [1]
+
+
+def test_trades_not_duplicated_after_crash(tmpdir):
+    path = str(tmpdir)
+    hist = OrderHistory(path)
+    # Crash after the trades are written but before the orders are
+    hist.orders.append = mock.MagicMock(side_effect=IOError)
+    with pytest.raises(IOError):
+        hist.append([make_order(1, trades=[TRADE])])
+    hist = OrderHistory(path)
+    assert len(hist.orders) == 0
+    assert hist.append([make_order(1, trades=[TRADE])]) == 1
+    assert list(hist.trades.data["id"]) == [77]
+
+
+def test_where(tmpdir):
+    hist = OrderHistory(str(tmpdir))
+    hist.append([
+        make_order(1, created_at="2019-01-01T00:00:00Z"),
+        make_order(2, created_at="2019-06-01T00:00:00Z"),
+        make_order(3, market_id=2, created_at="2019-06-01T00:00:00Z"),
+    ])
+    rows = hist.orders.where(market_id=1, start=parse_time("2019-03-01T00:00:00Z"))
+    assert list(rows["id"]) == [2]
+    assert list(hist.orders.where(market_id=2)["id"]) == [3]
+    # Duplicate appends are ignored
+    assert hist.append([make_order(1)]) == 0
+
+
+def test_sync_pages_whole_history(tmpdir):
+    ids = list(range(1, 351))
+
+    def orders(older_than=None, newer_than=None):
+        # Newest first, 100 per page, like the backend
+        page = [i for i in reversed(ids)
+                if (older_than is None or i < older_than) and (newer_than is None or i > newer_than)][:100]
+        return [make_order(i) for i in page]
+    api = mock.MagicMock()
+    api.orders.side_effect = orders
+    hist = OrderHistory(str(tmpdir), api)
+    assert hist.sync() == 350
+    assert hist.watermark == 350
+    ids.extend(range(351, 601))
+    assert hist.sync() == 250
+    assert sorted(hist.orders.data["id"]) == list(range(1, 601))
@@ -0,0 +1,106 @@
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.api import QtradeAPI, APIException
+from qtrade_client.metrics import Histogram, Metrics, endpoint_label
+from qtrade_client.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def api():
+    api = QtradeAPI("http://localhost:9898/")
+    api.metrics = Metrics()
+    return api
+
+
+def test_histogram_quantiles():
+    hist = Histogram()
+    for ms in range(1, 1001):
+        hist.record(ms / 1000.0)
+    assert hist.count == 1000
+    assert hist.min == 0.001 and hist.max == 1.0
+    for q in (0.5, 0.9, 0.99):
+        assert abs(hist.quantile(q) - q) / q < 0.02
+    assert hist.quantile(1) == 1.0
+
+
+def test_histogram_buckets_are_contiguous():
+    hist = Histogram(sub_bits=4)
+    for index in range(16, 200):
+        assert hist._bounds(index)[1] == hist._bounds(index + 1)[0]
+        low, high = hist._bounds(index)
+        assert hist._index(low) == index and hist._index(high - 1) == index
+
+
+def test_histogram_cumulative():
+    hist = Histogram()
+    for seconds in (0.0005, 0.003, 0.003, 2):
+        hist.record(seconds)
+    assert hist.cumulative((0.001, 0.01, 1, 10)) == [1, 3, 3, 4]
+
+
+def test_endpoint_label():
+    assert endpoint_label("/v1/user/order/123") == "/v1/user/order/:id"
+    assert endpoint_label("/v1/user/orders?open=true") == "/v1/user/orders"
+    assert endpoint_label("/v1/ticker/LTC_BTC") == "/v1/ticker/LTC_BTC"
+
+
+def test_request_metrics(api):
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {}}'))
+    api.get("/v1/user/order/5")
+    api.get("/v1/user/order/6")
+    snap = api.metrics_snapshot()
+    assert snap["latency"]["GET /v1/user/order/:id"]["count"] == 2
+    assert snap["decode"]["/v1/user/order/:id"]["count"] == 2
+    assert snap["lanes"]["account"]["requests"] == 2
+
+
+def test_retry_and_error_metrics(api):
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=429, headers={}, content=b'{"errors": [{"code": "too_many_requests"}]}'))
+    with mock.patch("time.sleep"):
+        with pytest.raises(APIException):
+            api.get("/v1/common")
+    snap = api.metrics.snapshot()
+    assert snap["retries_429"] == 1
+    assert snap["errors"] == [{"status": 429, "code": "too_many_requests", "count": 1}]
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_sleep_metrics(api):
+    api.limiter = RateLimiter(limit=100, remaining=0, reset_at=15)
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=200, headers={}, content=b'{"data": {}}'))
+    api.limiter.update = mock.MagicMock()
+    with mock.patch("time.sleep") as sleep:
+        api.post("/v1/user/cancel_order", id=1)
+    sleep.assert_called_once_with(5)
+    snap = api.metrics_snapshot()
+    assert snap["sleep"]["trade"]["sum"] == 5
+    assert snap["lanes"]["trade"]["hard_wait_time"] == 5
+
+
+def test_prometheus_text(api):
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(
+        status_code=400, headers={}, content=b'{"errors": [{"code": "invalid_amount"}]}'))
+    with pytest.raises(APIException):
+        api.post("/v1/user/sell_limit", amount="1")
+    text = api.metrics_prometheus()
+    assert "# TYPE qtrade_request_seconds histogram" in text
+    assert 'qtrade_request_seconds_count{endpoint="/v1/user/sell_limit",method="POST"} 1' in text
+    assert 'qtrade_request_seconds_bucket{endpoint="/v1/user/sell_limit",le="+Inf",method="POST"} 1' in text
+    assert 'qtrade_api_errors_total{code="invalid_amount",status="400"} 1' in text
+    assert 'qtrade_lane_wait_seconds_total{lane="trade",reason="soft"} 0.0' in text
+
+
+def test_lane_stats_without_metrics():
+    api = QtradeAPI("http://localhost:9898/")
+    assert api.metrics is None
+    assert api.metrics_snapshot() == {"lanes": api.scheduler.stats()}
+    text = api.metrics_prometheus()
+    assert 'qtrade_lane_queued{lane="market"} 0' in text
+    assert "qtrade_request_seconds" not in text
@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.api import QtradeAPI
+from qtrade_client.orderbook import OrderBook
+
+BOOK = {
+    "buy": {"0.00650000": "2", "0.00640000": "3", "0.00600000": "10"},
+    "sell": {"0.00700000": "1", "0.00710000": "4"},
+    "last_change": 1,
+}
+
+
+@pytest.fixture
+def api():
+    api = QtradeAPI("http://localhost:9898/")
+    market = {"id": 1, "string": "LTC_BTC", "maker_fee": "0", "taker_fee": "0.005"}
+    api._markets_map = {"LTC_BTC": market, 1: market}
+    api._refresh_common = lambda *args: None
+    return api
+
+
+@pytest.fixture
+def book(api):
+    book = OrderBook(api, "LTC_BTC")
+    book.load(BOOK)
+    return book
+
+
+def test_best(book):
+    assert book.best_bid() == Decimal("0.0065")
+    assert book.best_ask() == Decimal("0.007")
+
+
+def test_depth(book):
+    assert book.depth("buy", "0.0064") == Decimal(5)
+    assert book.depth("buy", "0.0066") == 0
+    assert book.depth("sell", "0.0075") == Decimal(5)
+    assert book.amount_at("sell", "0.0071") == Decimal(4)
+    assert book.amount_at("sell", "0.0072") == 0
+
+
+def test_vwap(book):
+    assert book.vwap("sell", "1") == Decimal("0.007")
+    assert book.vwap("sell", "2") == Decimal("0.00705")
+    assert book.vwap("buy", "4") == Decimal("0.00645")
+    assert book.vwap("sell", "6") is None
+
+
+def test_load_applies_diff(book):
+    side = book.sides["sell"]
+    assert book.load(dict(BOOK, sell={"0.00710000": "2", "0.00690000": "1"}, last_change=2)) == 3
+    assert side.keys == [690000, 710000]
+    assert book.best_ask() == Decimal("0.0069")
+    assert book.vwap("sell", "2") == Decimal("0.007")
+    # Unchanged since the last load
+    assert book.load(dict(BOOK, last_change=2)) == 0
+    assert book.best_ask() == Decimal("0.0069")
+
+
+def test_prevent_taker_uses_book(api):
+    api.get = mock.MagicMock(return_value=BOOK)
+    api.post = mock.MagicMock(return_value={"order": {}})
+    api.track_book("LTC_BTC")
+    api.get.assert_called_once_with("/v1/orderbook/LTC_BTC")
+    assert api.order("buy_limit", "0.007", amount="1", market_string="LTC_BTC",
+                     prevent_taker=True) == "order not placed"
+    api.order("buy_limit", "0.0069", amount="1", market_string="LTC_BTC", prevent_taker=True)
+    assert api.post.call_count == 1
+    results = dict(api.place_orders([
+        {"order_type": "sell_limit", "price": "0.0065", "amount": "1", "market_id": 1, "prevent_taker": True},
+        {"order_type": "sell_limit", "price": "0.0066", "amount": "1", "market_id": 1, "prevent_taker": True},
+    ]))
+    assert results[0] == "order not placed"
+    assert api.post.call_count == 2
+    # The book was fresh the whole time
+    assert api.get.call_count == 1
+
+
+def test_stale_book_refreshed(api):
+    api.get = mock.MagicMock(return_value=BOOK)
+    book = api.track_book("LTC_BTC")
+    book.updated_at -= 10
+    assert api._tracked_book(1) is book
+    assert api.get.call_count == 2
@@ -0,0 +1,94 @@
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.orders import OrderStore
+
+
+def make_order(order_id, market_id=1, order_type="buy_limit", open=True):
+    return {"id": order_id, "market_id": market_id, "order_type": order_type,
+            "open": open, "price": "0.001", "market_amount": "1"}
+
+
+def test_backfill_pages_backwards():
+    pages = {
+        None: [make_order(5), make_order(4)],
+        4: [make_order(3, open=False), make_order(2, market_id=2)],
+        2: [],
+    }
+    api = mock.MagicMock()
+    api.orders.side_effect = lambda older_than=None, newer_than=None: pages[older_than]
+    store = OrderStore(api)
+    assert store.backfill() == 4
+    assert (store.min_id, store.max_id) == (2, 5)
+    assert sorted(store.open) == [2, 4, 5]
+
+
+class NewestFirstAPI(object):
+    """ /v1/user/orders paging as the backend does it: newest first, at
+    most page_size orders between newer_than and older_than """
+
+    def __init__(self, n, page_size=100):
+        self.ids = list(range(1, n + 1))
+        self.page_size = page_size
+        self.calls = []
+
+    def orders(self, older_than=None, newer_than=None):
+        self.calls.append((older_than, newer_than))
+        ids = [i for i in reversed(self.ids)
+               if (older_than is None or i < older_than) and (newer_than is None or i > newer_than)]
+        return [make_order(i) for i in ids[:self.page_size]]
+
+
+def test_sync_fetches_delta():
+    api = mock.MagicMock()
+    store = OrderStore(api)
+    store.update([make_order(1), make_order(2)])
+    api.orders.return_value = [make_order(3, order_type="sell_limit"), make_order(2)]
+    assert store.sync() == [make_order(3, order_type="sell_limit")]
+    api.orders.assert_called_once_with(older_than=None, newer_than=2)
+    assert store.max_id == 3
+
+
+def test_sync_delta_larger_than_page():
+    api = NewestFirstAPI(350)
+    store = OrderStore(api)
+    assert store.backfill() == 350
+    assert [older for older, _ in api.calls] == [None, 251, 151, 51, 1]
+    api.ids.extend(range(351, 601))
+    api.calls = []
+    assert sorted(o['id'] for o in store.sync()) == list(range(351, 601))
+    # Only the delta is asked for, down to the newest order held
+    assert api.calls == [(None, 350), (501, 350), (401, 350), (351, 350)]
+    assert len(store.orders) == 600
+    assert store.max_id == 600
+    # Nothing new costs one empty page
+    api.calls = []
+    assert store.sync() == []
+    assert api.calls == [(None, 600)]
+
+
+def test_open_order_index():
+    store = OrderStore(mock.MagicMock())
+    store.update([
+        make_order(1), make_order(2, order_type="sell_limit"),
+        make_order(3, market_id=2), make_order(4, open=False),
+    ])
+    assert sorted(o['id'] for o in store.open_orders()) == [1, 2, 3]
+    assert sorted(o['id'] for o in store.open_orders(market_id=1)) == [1, 2]
+    assert [o['id'] for o in store.open_orders(market_id=1, side="sell")] == [2]
+    assert sorted(o['id'] for o in store.open_orders(side="buy")) == [1, 3]
+    assert store.open_orders(market_id=99) == []
+
+
+def test_refresh_open_closes_missing():
+    api = mock.MagicMock()
+    store = OrderStore(api)
+    store.update([make_order(1), make_order(2)])
+    api.orders.return_value = [make_order(2)]
+    store.refresh_open()
+    api.orders.assert_called_once_with(open=True)
+    assert list(store.open) == [2]
+    assert store.orders[1]['open'] is False
+    assert store.open_orders(market_id=1) == [make_order(2)]
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.api import QtradeAPI
+from qtrade_client.poller import Poller
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = Clock()
+    with mock.patch("time.time", clock):
+        yield clock
+
+
+@pytest.fixture
+def api():
+    api = QtradeAPI("http://localhost:9898/")
+    api.get = mock.MagicMock(return_value={"markets": [{"id": 1, "last": "1"}, {"id": 2, "last": "5"}]})
+    return api
+
+
+def test_subscriptions_share_requests(api, clock):
+    poller = Poller(api)
+    fast, slow = [], []
+    poller.subscribe("/v1/tickers", 5, fast.append)
+    poller.subscribe("/v1/tickers", 20, slow.append)
+    poller.subscribe("/v1/user/balances", 10, lambda d: None)
+    assert poller.poll_once() == 1.0
+    assert api.get.call_count == 2
+    assert len(fast) == len(slow) == 1
+    for _ in range(4):
+        clock.now += 5
+        poller.poll_once()
+    # One tickers request every 5s serves both subscribers
+    tickers_calls = [c for c in api.get.call_args_list if c[0][0] == "/v1/tickers"]
+    assert len(tickers_calls) == 5
+
+
+def test_only_changed_views_delivered(api, clock):
+    poller = Poller(api)
+    first, second = [], []
+    poller.subscribe("/v1/tickers", 5, first.append, select=lambda d: d["markets"][0]["last"])
+    poller.subscribe("/v1/tickers", 5, second.append, select=lambda d: d["markets"][1]["last"])
+    poller.poll_once()
+    api.get.return_value = {"markets": [{"id": 1, "last": "2"}, {"id": 2, "last": "5"}]}
+    clock.now += 5
+    poller.poll_once()
+    assert first == ["1", "2"]
+    assert second == ["5"]
+
+
+def test_params_are_separate_jobs(api, clock):
+    poller = Poller(api, priority=2)
+    poller.subscribe("/v1/user/orders", 5, lambda d: None, open="true")
+    poller.subscribe("/v1/user/orders", 5, lambda d: None, open="false")
+    poller.poll_once()
+    assert sorted(c[1]["open"] for c in api.get.call_args_list) == ["false", "true"]
+    assert all(c[1]["priority"] == 2 for c in api.get.call_args_list)
+
+
+def test_unsubscribe(api, clock):
+    poller = Poller(api)
+    sub = poller.subscribe("/v1/tickers", 5, lambda d: None)
+    poller.poll_once()
+    poller.unsubscribe(sub)
+    clock.now += 5
+    poller.poll_once()
+    assert api.get.call_count == 1
+
+
+def test_failures_logged(api, clock, caplog):
+    poller = Poller(api)
+    api.get.side_effect = ValueError("boom")
+    poller.subscribe("/v1/tickers", 5, lambda d: None)
+    poller.poll_once()
+    api.get.side_effect = None
+    poller.subscribe("/v1/user/balances", 5, mock.MagicMock(side_effect=KeyError("x")))
+    poller.poll_once()
+    assert "Polling /v1/tickers failed" in caplog.text
+    assert "Poll subscriber for /v1/user/balances failed" in caplog.text
+
+
+def test_background_thread(api):
+    poller = Poller(api)
+    got = threading.Event()
+    poller.subscribe("/v1/tickers", 60, lambda d: got.set())
+    poller.start()
+    try:
+        assert got.wait(5)
+    finally:
+        poller.stop()
@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from qtrade_client.api import QtradeAPI
+from qtrade_client.ratelimit import (RateLimiter, FileRateLimiter, RequestScheduler,
+                                     request_priority, PRIORITY_TRADE,
+                                     PRIORITY_ACCOUNT, PRIORITY_MARKET)
+
+
+@pytest.fixture
+def api():
+    return QtradeAPI("http://localhost:9898/")
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_reserve_takes_tokens():
+    rl = RateLimiter(limit=10, remaining=10, reset_at=20, soft_threshold=1)
+    assert rl.reserve() == 0
+    assert rl.remaining == 9
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_exhausted_bucket_holds_later_callers():
+    rl = RateLimiter(limit=10, remaining=0, reset_at=15, soft_threshold=1)
+    assert rl.reserve() == 5
+    # The next caller draws on the same upcoming window, so it waits too
+    assert rl.reserve() == 5
+    assert rl.remaining == 8
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_refill_after_reset():
+    rl = RateLimiter(limit=10, remaining=0, reset_at=5)
+    assert rl.reserve() == 0
+    assert rl.remaining == 9
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_update_from_headers():
+    rl = RateLimiter()
+    rl.update({'X-Ratelimit-Reset': '30', 'X-Ratelimit-Limit': '60',
+               'X-Ratelimit-Remaining': '12'})
+    assert (rl.reset_at, rl.limit, rl.remaining) == (40, 60, 12)
+
+
+def test_threads_share_budget():
+    rl = RateLimiter(limit=1000, remaining=1000, reset_at=float("inf"), soft_threshold=1)
+
+    def worker():
+        for _ in range(100):
+            rl.reserve()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert rl.remaining == 200
+
+
+def test_clients_share_limiter():
+    rl = RateLimiter()
+    a = QtradeAPI("http://localhost:9898/", limiter=rl)
+    b = QtradeAPI("http://localhost:9898/", limiter=rl)
+    a.rl_remaining = 3
+    assert b.rl_remaining == 3
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_file_limiter_shared(tmpdir):
+    path = str(tmpdir.join("ratelimit"))
+    a = FileRateLimiter(path, limit=10, remaining=10, reset_at=20, soft_threshold=1)
+    # A second process opening the same file picks up the existing bucket
+    b = FileRateLimiter(path, limit=99, remaining=99, reset_at=99)
+    a.reserve()
+    b.reserve()
+    assert a.remaining == b.remaining == 8
+    assert b.limit == 10
+
+
+def test_request_priority():
+    assert request_priority("post", "/v1/user/cancel_order") == PRIORITY_TRADE
+    assert request_priority("get", "/v1/user/balances") == PRIORITY_ACCOUNT
+    assert request_priority("get", "/v1/tickers") == PRIORITY_MARKET
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_lanes_reserve_budget():
+    sched = RequestScheduler(RateLimiter(limit=100, remaining=15, reset_at=20))
+    # Market data leaves the last 20% of the window to other lanes
+    with sched.lane(PRIORITY_MARKET) as must_wait:
+        assert must_wait == 10
+    # Cancels go through it, paced by the soft threshold
+    with sched.lane(PRIORITY_TRADE) as must_wait:
+        assert must_wait == 10 / 15.0
+    # Account reads have their own smaller reserve
+    with sched.lane(PRIORITY_ACCOUNT) as must_wait:
+        assert must_wait == 10 / 14.0
+    assert sched.limiter.remaining == 13
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_trade_lane_burst_is_opt_in():
+    limiter = RateLimiter(limit=100, remaining=15, reset_at=20, soft_threshold=0)
+    sched = RequestScheduler(limiter)
+    # No burst at all unless asked for
+    with sched.lane(PRIORITY_TRADE) as must_wait:
+        assert must_wait == 10 / 15.0
+    sched.trade_burst = True
+    with sched.lane(PRIORITY_TRADE) as must_wait:
+        assert must_wait == 0
+    with sched.lane(PRIORITY_ACCOUNT) as must_wait:
+        assert must_wait == 10 / 13.0
+
+
+@mock.patch("time.time", mock.MagicMock(return_value=10))
+def test_lane_stats():
+    sched = RequestScheduler(RateLimiter(limit=100, remaining=15, reset_at=20))
+    with sched.lane(PRIORITY_MARKET):
+        assert sched.stats()["market"]["queued"] == 1
+    stats = sched.stats()
+    assert stats["market"] == {"queued": 0, "requests": 1, "waited": 1,
+                               "wait_time": 10, "max_wait": 10, "hard_wait_time": 0,
+                               "soft_wait_time": 0, "reserve_wait_time": 10}
+    assert stats["trade"]["requests"] == 0
+    with sched.lane(PRIORITY_ACCOUNT):
+        pass
+    assert sched.stats()["account"]["soft_wait_time"] == 10 / 15.0
+
+
+def test_req_uses_lane(api):
+    api.scheduler.lane = mock.MagicMock(wraps=api.scheduler.lane)
+    api.rs.request = mock.MagicMock(return_value=mock.MagicMock(status_code=200))
+    api.post("/v1/user/cancel_order", json={"id": 1})
+    api.scheduler.lane.assert_called_with(PRIORITY_TRADE)
+    api.get("/v1/user/balances", priority=PRIORITY_TRADE)
+    api.scheduler.lane.assert_called_with(PRIORITY_TRADE)
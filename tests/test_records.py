@@ -0,0 +1,110 @@
+import json
+import math
+from decimal import Decimal
+
+import pytest
+
+from qtrade_client.api import QtradeAPI, _fee_mult
+from qtrade_client.records import Currency, Market, RecordIndex, Ticker, TickerColumns
+
+BTC = {"code": "BTC", "precision": 8, "config": {"price": 8614.27}}
+GRIN = {"code": "GRIN", "precision": 9, "new_field": 1}
+MARKET = {"id": 23, "base_currency": "BTC", "market_currency": "GRIN",
+          "maker_fee": "0", "taker_fee": "0.0075", "can_trade": True}
+
+
+def currencies():
+    return {"BTC": Currency(BTC), "GRIN": Currency(GRIN)}
+
+
+def test_record_dict_access():
+    cur = Currency(GRIN)
+    assert cur["code"] == cur.code == "GRIN"
+    # Unknown keys are kept, missing known ones raise KeyError
+    assert cur["new_field"] == 1
+    assert "status" not in cur
+    with pytest.raises(KeyError):
+        cur["status"]
+    assert cur.get("status", "ok") == "ok"
+    assert cur == GRIN and cur != BTC
+    assert dict(cur) == GRIN
+
+
+def test_market_derived_fields():
+    market = Market(MARKET, currencies())
+    assert market["string"] == "GRIN_BTC"
+    assert market.base_currency["config"]["price"] == 8614.27
+    assert market.fee_mult == Decimal("1.0075") == _fee_mult(MARKET)
+    assert _fee_mult(market) is market.fee_mult
+    assert "fee_mult" not in market.to_dict()
+    # Nested currencies come out as dicts, so the whole market dumps to JSON
+    assert market.to_dict()["base_currency"] == BTC
+    assert json.loads(json.dumps(market.to_dict()))["market_currency"] == GRIN
+
+
+def test_record_index():
+    index = RecordIndex([Ticker({"id": 3, "id_hr": "LTC_BTC"}),
+                         Ticker({"id": 1, "id_hr": "BIS_BTC"})], "id_hr")
+    assert index[3] is index["LTC_BTC"]
+    assert index.get(2) is None and index.get(-1) is None
+    assert sorted(index.names()) == ["BIS_BTC", "LTC_BTC"]
+    assert [t["id"] for t in index.values()] == [1, 3]
+    assert set(index) == {1, 3, "BIS_BTC", "LTC_BTC"}
+
+
+def test_order_with_records():
+    api = QtradeAPI("http://localhost:9898/")
+    api._load_common({"currencies": [BTC, GRIN], "markets": [MARKET]})
+    api._load_tickers({"markets": [{"id": 23, "id_hr": "GRIN_BTC", "ask": "0.0001", "bid": "0.00009"}]})
+    api.post = lambda endpoint, **params: params
+    assert api.order("buy_limit", "0.0001", value="0.01", market_string="GRIN_BTC",
+                     prevent_taker=True) == {
+        "amount": "99.25558313", "price": "0.00010000", "market_id": 23}
+    assert api.order("buy_limit", "0.0002", value="0.01", market_id=23,
+                     prevent_taker=True) == "order not placed"
+
+
+def test_order_ignores_currency_precision():
+    api = QtradeAPI("http://localhost:9898/")
+    api._load_common({"currencies": [BTC, dict(GRIN, precision=0)], "markets": [MARKET]})
+    api.post = lambda endpoint, **params: params
+    # Amounts keep 8 places whatever the currency's precision
+    assert api.order("buy_limit", "0.00012346", value="0.01", market_id=23) == {
+        "amount": "80.39493206", "price": "0.00012346", "market_id": 23}
+
+
+TICKERS = {"markets": [
+    {"id": 3, "id_hr": "LTC_BTC", "bid": "0.0066", "ask": "0.0070", "last": "0.0068",
+     "day_volume_base": "1.5", "day_volume_market": "220"},
+    {"id": 1, "id_hr": "MMO_BTC", "bid": None, "ask": None, "last": "0.00000076",
+     "day_volume_base": "0", "day_volume_market": "0"},
+]}
+
+
+def test_ticker_columns():
+    api = QtradeAPI("http://localhost:9898/")
+    api._load_tickers(TICKERS)
+    api._refresh_tickers = lambda *args: None
+    cols = api.ticker_columns
+    assert cols is api.ticker_columns
+    assert list(cols.ids) == [1, 3]
+    row = cols.row("LTC_BTC")
+    assert cols.row(3) == row
+    assert (cols.bid[row], cols.ask[row], cols.day_volume_base[row]) == (0.0066, 0.0070, 1.5)
+    assert math.isnan(cols.bid[cols.row(1)])
+    # A new snapshot gets new columns
+    api._load_tickers(TICKERS)
+    assert api.ticker_columns is not cols
+
+
+def test_ticker_columns_numpy():
+    numpy = pytest.importorskip("numpy")
+    cols = TickerColumns(Ticker(t) for t in TICKERS["markets"])
+    arrays = cols.as_numpy()
+    spread = arrays["ask"] - arrays["bid"]
+    assert numpy.isclose(spread[0], 0.0004)
+    assert numpy.isnan(spread[1])
+    assert list(arrays["id"]) == [3, 1]
+    # numpy ids look records up like ints do
+    index = RecordIndex([Ticker(t) for t in TICKERS["markets"]], "id_hr")
+    assert index[arrays["id"][0]]["id_hr"] == "LTC_BTC"
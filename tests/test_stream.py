@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from qtrade_client.stream import iter_json_array
+
+
+DOC = {
+    "data": {
+        "currencies": [{"code": "BTC", "note": "\"markets\": [not this one]"}],
+        "markets": [
+            {"id": 1, "id_hr": "LTC_BTC", "ask": "0.007", "n": 12345},
+            {"id": 2, "id_hr": u"ÉTH_BTC", "ask": None, "flag": True},
+            12.5,
+        ],
+        "trailing": {"ignored": True},
+    }
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 100000])
+def test_chunk_boundaries(size):
+    raw = json.dumps(DOC, ensure_ascii=False).encode('utf8')
+    items = list(iter_json_array(chunked(raw, size), ("data", "markets")))
+    assert items == DOC["data"]["markets"]
+
+
+def test_empty_array():
+    assert list(iter_json_array([b'{"data": {"orders": [ ]}}'], ("data", "orders"))) == []
+
+
+def test_yields_before_stream_ends():
+    def chunks():
+        yield b'{"data": {"orders": [{"id": 1}, '
+        raise AssertionError("read past the first record")
+
+    records = iter_json_array(chunks(), ("data", "orders"))
+    assert next(records) == {"id": 1}
+
+
+def test_missing_key():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'{"data": {"markets": []}}'], ("data", "orders")))
+
+
+def test_truncated():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'{"data": {"orders": [{"id": 1}, {"id"'], ("data", "orders")))